@@ -0,0 +1,56 @@
+"""Shared fixtures for the checks of the statistics kernels against the pandas,
+statsmodels and scipy implementations they replace.
+
+Run with ``python -m pytest`` from this directory; the statsmodels and DuckDB
+comparisons are skipped when those optional packages aren't installed.
+"""
+import numpy as np
+import pandas as pd
+
+VALUE_COLUMNS = ['EnglishScore', 'MathScore', 'PhysicsScore']
+METHODS = ['Group Learning', 'Facilitator', 'Lecture-based Instruction', 'Inquiry-based Learning']
+EXACT_COLUMNS = ['Count', 'Mean', 'StdDev', 'Variance', 'Range', 'CI']  # kept without histograms
+
+
+def scores(kind, n=600, seed=0):
+    rng = np.random.default_rng(seed)
+    method = rng.choice(METHODS, n)
+    shift = pd.Series(method).map({m: 3 * i for i, m in enumerate(METHODS)}).to_numpy()
+    df = pd.DataFrame({'StudentID': np.arange(1, n + 1), 'TeachingMethod': method})
+    for column in VALUE_COLUMNS:
+        df[column] = rng.integers(60, 90, n) + shift
+    if kind in ('missing', 'fractional'):
+        for column in VALUE_COLUMNS:
+            df[column] = df[column].astype(np.float64).mask(rng.random(n) < 0.1)
+    if kind == 'fractional':
+        df[VALUE_COLUMNS] += rng.random((n, len(VALUE_COLUMNS))).round(2)
+    return df
+
+
+def melt_scores(df):
+    melted = df.melt(id_vars=['StudentID', 'TeachingMethod'], value_vars=VALUE_COLUMNS,
+                     var_name='Subject', value_name='Score')
+    melted['Subject'] = melted['Subject'].str.replace('Score', '')
+    return melted
+
+
+def groupby_reference(df):
+    # The dashboard's original melt + groupby aggregation.
+    table = melt_scores(df).groupby(['TeachingMethod', 'Subject']).agg(
+        Count=('Score', 'count'),
+        Mean=('Score', 'mean'),
+        Median=('Score', 'median'),
+        Mode=('Score', lambda x: x.mode().iloc[0] if not x.mode().empty else None),
+        StdDev=('Score', 'std'),
+        Variance=('Score', 'var'),
+        Range=('Score', lambda x: x.max() - x.min()),
+        IQR=('Score', lambda x: x.quantile(0.75) - x.quantile(0.25))
+    ).reset_index()
+    table['CI'] = 1.96 * (table['StdDev'] / np.sqrt(table['Count']))
+    return table
+
+
+def assert_same_table(table, reference, columns=None):
+    columns = ['TeachingMethod', 'Subject'] + (columns or EXACT_COLUMNS + ['Median', 'Mode', 'IQR'])
+    pd.testing.assert_frame_equal(table[columns].reset_index(drop=True), reference[columns],
+                                  check_dtype=False, check_exact=False, rtol=1e-9)
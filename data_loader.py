@@ -0,0 +1,321 @@
+"""Loading of the teaching workbook behind a process-wide, content-addressed cache.
+
+Streamlit reruns the dashboard script on every widget interaction and in every
+browser session.  Parsing the workbook with openpyxl dominates that rerun, so
+parsed frames are kept here, keyed by a hash of the workbook bytes, and shared
+by all sessions of the server process.  A file is only re-hashed when its
+mtime or size changes, and only re-parsed when its content actually changed.
+
+The first parse of a workbook version also writes a typed Parquet sidecar next
+to it (``<stem>.<sheet>.parquet``).  Later processes read that sidecar, with
+column projection, instead of going through openpyxl; it is rebuilt whenever the
+workbook is newer than it or its recorded source hash no longer matches.
+
+Setting ``TEACHING_DATA_BACKEND=arrow`` swaps the sidecar for an uncompressed
+Arrow IPC file (``<stem>.<sheet>.arrow``) that is memory-mapped on load.  Its
+numeric columns become zero-copy views of the mapped file, so several server
+processes on one box share the OS page cache instead of each holding private
+copies of the score table.
+
+String columns are dictionary-encoded in the sidecars and come back as plain
+strings, or as categoricals in a caller's fixed order with ``categories``.
+Scores are stored in the narrowest integer type that holds them and IDs as at
+least int32; ``memory_footprint`` reports what that saves over the dtypes
+``read_excel`` would have produced.  The narrow type only survives loading for
+columns without missing values: pandas has no NaN for NumPy integers, so a
+score column with gaps comes back as float64 (the statistics kernels take
+plain NumPy arrays, not pandas' masked ``UInt8``/``Int8`` arrays).
+
+``iter_sheet_chunks`` streams a sheet in bounded-size chunks instead, for
+computations that accumulate over extracts too large to hold in memory.
+
+Frames returned from the cache are shared objects: callers must not mutate them.
+"""
+import hashlib
+import io
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+DATA_PATH = "teaching_data.xlsx"
+SHEET_NAME = "Sheet1"
+DATA_BACKEND = os.environ.get("TEACHING_DATA_BACKEND", "parquet")
+
+_lock = threading.Lock()
+_parse_lock = threading.Lock()
+_versions = {}  # absolute path -> ((mtime_ns, size), content hash)
+_frames = {}    # (content hash, sheet name, columns, backend, categories) -> parsed DataFrame
+
+_SOURCE_HASH_KEY = b"teaching_dashboard.source_sha256"
+_NARROW_INT_TYPES = [pa.uint8(), pa.int8(), pa.uint16(), pa.int16(), pa.int32(), pa.int64()]
+
+
+def _stat_key(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _remember_version(path, stat_key, version):
+    with _lock:
+        previous = _versions.get(path)
+        _versions[path] = (stat_key, version)
+        if previous and previous[1] != version:
+            # Keep one parsed version per workbook so edits don't accumulate frames.
+            still_used = {v for _, v in _versions.values()}
+            for key in [k for k in _frames if k[0] == previous[1] and k[0] not in still_used]:
+                del _frames[key]
+
+
+def data_version(path=DATA_PATH):
+    """Return the content hash of ``path``, re-hashing only if its mtime or size changed."""
+    path = os.path.abspath(path)
+    stat_key = _stat_key(path)
+    with _lock:
+        cached = _versions.get(path)
+    if cached and cached[0] == stat_key:
+        return cached[1]
+    with open(path, "rb") as fh:
+        version = _hash_bytes(fh.read())
+    _remember_version(path, stat_key, version)
+    return version
+
+
+def _read_parquet(target, columns):
+    return pq.read_table(target, columns=columns)
+
+
+def _write_parquet(table, target):
+    pq.write_table(table, target)
+
+
+def _read_arrow(target, columns):
+    return feather.read_table(target, columns=columns, memory_map=True)
+
+
+def _write_arrow(table, target):
+    # One uncompressed record batch keeps every column contiguous, so pandas can
+    # wrap the mapped buffers without concatenating chunks.
+    feather.write_feather(table.combine_chunks(), target, compression="uncompressed",
+                          chunksize=max(table.num_rows, 1))
+
+
+def _arrow_schema(target):
+    with pa.memory_map(target) as source:
+        return pa.ipc.open_file(source).schema
+
+
+# backend -> (sidecar extension, reader, writer, schema reader)
+_BACKENDS = {
+    "parquet": (".parquet", _read_parquet, _write_parquet, pq.read_schema),
+    "arrow": (".arrow", _read_arrow, _write_arrow, _arrow_schema),
+}
+
+
+def sidecar_path(path=DATA_PATH, sheet_name=SHEET_NAME, backend=DATA_BACKEND):
+    extension = _BACKENDS[backend][0]
+    return f"{os.path.splitext(os.path.abspath(path))[0]}.{sheet_name}{extension}"
+
+
+def _arrow_column(name, values):
+    if pd.api.types.is_object_dtype(values) or isinstance(values.dtype, pd.CategoricalDtype):
+        return pa.array(values.astype(object), type=pa.string()).dictionary_encode()
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        present = values.dropna()
+        if present.empty or not np.all(np.mod(present, 1) == 0):
+            return pa.array(values, from_pandas=True)
+        lo, hi = present.min(), present.max()
+        # IDs keep room to grow; scores and other small integers get the narrowest type.
+        candidates = _NARROW_INT_TYPES[4:] if name.endswith("ID") else _NARROW_INT_TYPES
+        for arrow_type in candidates:
+            info = np.iinfo(arrow_type.to_pandas_dtype())
+            if info.min <= lo and hi <= info.max:
+                return pa.array(values, type=arrow_type, from_pandas=True)
+    return pa.array(values, from_pandas=True)
+
+
+def to_arrow_table(df, version=None):
+    """Convert a sheet frame to a compactly typed Arrow table."""
+    table = pa.table({name: _arrow_column(name, df[name]) for name in df.columns})
+    if version is not None:
+        table = table.replace_schema_metadata({_SOURCE_HASH_KEY: version.encode()})
+    return table
+
+
+def _categorical(values, order):
+    # Labels missing from ``order`` are appended (sorted) rather than turned into NaN.
+    labels = values.cat.categories if isinstance(values.dtype, pd.CategoricalDtype) else values.dropna().unique()
+    extra = sorted(set(labels) - set(order))
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # astype would keep the old order: unordered dtypes with the same labels compare equal.
+        return values.cat.set_categories(list(order) + extra)
+    return values.astype(pd.CategoricalDtype(list(order) + extra))
+
+
+def _to_frame(table, categories=None):
+    # Dictionary encoding is a storage detail; unless a column is asked for as a
+    # categorical, the dashboard groups and plots plain labels.
+    categories = categories or {}
+    schema = pa.schema([
+        field.with_type(field.type.value_type)
+        if pa.types.is_dictionary(field.type) and field.name not in categories else field
+        for field in table.schema
+    ])
+    # split_blocks stops pandas from consolidating (and so copying) mapped columns.
+    frame = table.cast(schema).to_pandas(split_blocks=True)
+    for name, order in categories.items():
+        if name in frame:
+            frame[name] = _categorical(frame[name], order)
+    return frame
+
+
+def _write_atomic(write, target):
+    tmp = f"{target}.{os.getpid()}.tmp"
+    try:
+        write(tmp)
+        # Replacing (rather than rewriting) the file keeps existing memory maps valid.
+        os.replace(tmp, target)
+    except OSError:
+        # A read-only deployment just keeps parsing the workbook.
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return False
+    return True
+
+
+def _sidecar_is_fresh(target, read_schema, source_mtime_ns, version):
+    try:
+        if os.stat(target).st_mtime_ns < source_mtime_ns:
+            return False
+        metadata = read_schema(target).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return False
+    return metadata.get(_SOURCE_HASH_KEY) == version.encode()
+
+
+def _read_sheet(path, sheet_name, columns, backend, data, stat_key, version, categories):
+    _, read, write, read_schema = _BACKENDS[backend]
+    target = sidecar_path(path, sheet_name, backend)
+    if _sidecar_is_fresh(target, read_schema, stat_key[0], version):
+        return _to_frame(read(target, columns), categories)
+    table = to_arrow_table(pd.read_excel(io.BytesIO(data), sheet_name=sheet_name), version)
+    if _write_atomic(lambda tmp: write(table, tmp), target) and backend == "arrow":
+        # Serve the mapped file rather than the heap copy we just parsed.
+        return _to_frame(read(target, columns), categories)
+    if columns is not None:
+        table = table.select(columns)
+    return _to_frame(table, categories)
+
+
+def load_sheet(path=DATA_PATH, sheet_name=SHEET_NAME, columns=None, backend=None, categories=None):
+    """Return ``(df, version)`` for ``sheet_name`` of the workbook at ``path``.
+
+    ``columns`` optionally projects the sheet to a subset of its columns and
+    ``backend`` (``"parquet"`` or ``"arrow"``) overrides ``DATA_BACKEND``.
+    ``categories`` maps column names to a category order: those columns come
+    back as categoricals with that order, followed by any labels it doesn't list.
+    ``version`` is the content hash of the workbook and can be used as a cache key
+    for anything derived from ``df``.
+    """
+    path = os.path.abspath(path)
+    columns = list(columns) if columns is not None else None
+    projection = tuple(columns) if columns is not None else None
+    categories = {name: tuple(order) for name, order in (categories or {}).items()}
+    schema = tuple(sorted(categories.items()))
+    backend = backend or DATA_BACKEND
+    if backend not in _BACKENDS:
+        raise ValueError(f"Unknown data backend {backend!r}; expected one of {sorted(_BACKENDS)}")
+    stat_key = _stat_key(path)
+    with _lock:
+        cached = _versions.get(path)
+        if cached and cached[0] == stat_key and (cached[1], sheet_name, projection, backend, schema) in _frames:
+            return _frames[(cached[1], sheet_name, projection, backend, schema)], cached[1]
+
+    with _parse_lock:
+        # Hash and parse the same bytes so the cache key always matches the content.
+        with open(path, "rb") as fh:
+            data = fh.read()
+        version = _hash_bytes(data)
+        _remember_version(path, stat_key, version)
+        with _lock:
+            df = _frames.get((version, sheet_name, projection, backend, schema))
+        if df is None:
+            df = _read_sheet(path, sheet_name, columns, backend, data, stat_key, version, categories)
+            with _lock:
+                _frames[(version, sheet_name, projection, backend, schema)] = df
+    return df, version
+
+
+def _default_dtype(values):
+    # What read_excel gives a column: object for labels, 64-bit for numbers.
+    if isinstance(values.dtype, pd.CategoricalDtype) or pd.api.types.is_object_dtype(values):
+        return object
+    if values.dtype.kind in 'iu':
+        return np.int64
+    if values.dtype.kind == 'f':
+        return np.float64
+    return values.dtype
+
+
+def memory_footprint(df):
+    """Return ``(bytes, default_bytes)``: the deep memory use of ``df`` and of the
+    same columns with the dtypes ``read_excel`` would have given them."""
+    used = int(df.memory_usage(index=False, deep=True).sum())
+    default = sum(int(df[name].astype(_default_dtype(df[name])).memory_usage(index=False, deep=True))
+                  for name in df.columns)
+    return used, default
+
+
+def _rows_to_frame(rows, header, columns):
+    frame = pd.DataFrame.from_records(rows, columns=header)
+    return frame if columns is None else frame[columns]
+
+
+def iter_sheet_chunks(path=DATA_PATH, sheet_name=SHEET_NAME, columns=None, chunk_rows=100_000, backend=None):
+    """Yield the sheet as frames of at most ``chunk_rows`` rows, never loading it whole.
+
+    A fresh sidecar is read batch by batch (slices of the memory map for the
+    Arrow backend); otherwise rows are streamed from the workbook with openpyxl's
+    read-only mode.  Chunks are not cached.
+    """
+    path = os.path.abspath(path)
+    columns = list(columns) if columns is not None else None
+    backend = backend or DATA_BACKEND
+    _, read, _, read_schema = _BACKENDS[backend]
+    target = sidecar_path(path, sheet_name, backend)
+    if _sidecar_is_fresh(target, read_schema, _stat_key(path)[0], data_version(path)):
+        if backend == "parquet":
+            for batch in pq.ParquetFile(target).iter_batches(batch_size=chunk_rows, columns=columns):
+                yield _to_frame(pa.Table.from_batches([batch]))
+        else:
+            table = read(target, columns)
+            for offset in range(0, table.num_rows, chunk_rows):
+                yield _to_frame(table.slice(offset, chunk_rows))
+        return
+
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        chunk = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            chunk.append(row)
+            if len(chunk) == chunk_rows:
+                yield _rows_to_frame(chunk, header, columns)
+                chunk = []
+        if chunk:
+            yield _rows_to_frame(chunk, header, columns)
+    finally:
+        workbook.close()
@@ -0,0 +1,130 @@
+"""Serialised Plotly figures, and emitting them without rebuilding the figure.
+
+Building a ``go.Figure`` (or a ``px`` chart) validates every property, and
+``st.plotly_chart`` validates and serialises it again on each rerun, even when
+nothing it depends on has changed.  The dashboard instead stores each figure's
+JSON once per (data version, chart id) in the registry, and
+``plotly_chart_json`` sends that JSON straight to the browser, skipping both.
+
+Templates are applied at that last step rather than cached into every figure:
+``template_free_json`` stores a figure without one and ``with_template`` splices
+the named template's JSON into its layout, which plotly.js then applies in the
+browser.  Switching templates therefore rebuilds nothing, except for figures
+whose traces take values from the template while being built: ``px`` charts
+colour any label missing from ``color_discrete_map`` from the template's
+colorway, so those have to be built with the template and stored per template.
+``discrete_colors`` gives ``go`` charts the same colours, and the same
+per-template storage.
+
+Numeric trace arrays are rounded to ``SIGNIFICANT_DIGITS`` before they are
+stored, and whole-number arrays are written as integers, so a payload never
+spells out seventeen digits the chart can't show.  (The plotly.js bundled with
+streamlit 1.30 predates base64 typed-array payloads, so arrays stay JSON.)
+
+``plotly_chart_json`` fills the same ``PlotlyChart`` message ``st.plotly_chart``
+does; it relies on Streamlit internals and is written against streamlit 1.30.
+"""
+import functools
+import json
+
+import numpy as np
+import plotly.io
+import plotly.utils
+from plotly.colors import qualitative
+import streamlit as st
+from streamlit.proto.PlotlyChart_pb2 import PlotlyChart as PlotlyChartProto
+
+SIGNIFICANT_DIGITS = 5  # kept in trace arrays: more than axes, hovers or bar labels display
+
+# What st.plotly_chart sends when no config is passed.
+_DEFAULT_CONFIG = json.dumps({"showLink": False, "linkText": False})
+
+
+def figure_json(figure):
+    """The JSON ``st.plotly_chart`` would send for ``figure``."""
+    return plotly.io.to_json(figure, validate=False)
+
+
+def round_significant(values, digits=SIGNIFICANT_DIGITS):
+    """``values`` rounded to ``digits`` significant digits, as int64 if all whole numbers."""
+    values = np.asarray(values, dtype=np.float64)
+    finite = np.isfinite(values) & (values != 0)
+    exponent = np.zeros(values.shape)
+    exponent[finite] = np.floor(np.log10(np.abs(values[finite])))
+    decimals = digits - 1 - exponent
+    with np.errstate(over='ignore', invalid='ignore'):
+        # Dividing by an exact power of ten keeps the shortest repr of each result short.
+        scale = 10.0 ** np.abs(decimals)
+        rounded = np.where(decimals >= 0, np.round(values * scale) / scale, np.round(values / scale) * scale)
+    # Subnormals (e.g. an underflowed p-value) need a scale beyond float range; keep them as they are.
+    rounded = np.where(np.isfinite(scale), rounded, values)
+    if np.isfinite(rounded).all() and (rounded == np.round(rounded)).all() and np.abs(rounded).max(initial=0) < 2 ** 53:
+        return rounded.astype(np.int64)
+    return rounded
+
+
+def _compact(value, digits):
+    if isinstance(value, dict):
+        return {key: _compact(item, digits) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)) and len(value):
+        if isinstance(value, np.ndarray):
+            array = value
+        elif all(isinstance(item, (int, float)) and not isinstance(item, bool) for item in value):
+            array = np.asarray(value)
+        elif all(isinstance(item, (list, tuple, np.ndarray)) for item in value):
+            return [_compact(item, digits) for item in value]
+        else:
+            return value
+        if array.dtype.kind == 'f':
+            return round_significant(array, digits)
+    return value
+
+
+def template_free_json(figure, digits=SIGNIFICANT_DIGITS):
+    """``figure_json`` of ``figure`` with its template removed, for ``with_template``,
+    and its trace arrays rounded to ``digits`` significant digits."""
+    figure.layout.template = None
+    spec = figure.to_dict()
+    spec['data'] = [_compact(trace, digits) for trace in spec['data']]
+    return plotly.io.to_json(spec, validate=False)
+
+
+@functools.lru_cache(maxsize=None)
+def template_json(name):
+    return json.dumps(plotly.io.templates[name].to_plotly_json(), cls=plotly.utils.PlotlyJSONEncoder)
+
+
+def with_template(spec, template):
+    """A ``template_free_json`` spec with the named template set as its ``layout.template``."""
+    # plotly.io.to_json writes "layout" as the figure's last key, so its object
+    # runs to the final closing brace.
+    head, key, layout = spec.rpartition('"layout":')
+    layout = layout.strip()[:-1].strip()
+    rest = layout[1:].strip()
+    separator = '' if rest == '}' else ','
+    return f'{head}{key}{{"template":{template_json(template)}{separator}{rest}}}'
+
+
+def discrete_colors(labels, color_map, template):
+    """The colour ``px`` would give each of ``labels`` with ``color_discrete_map=color_map``.
+
+    Labels missing from ``color_map`` take the next colour of the template's
+    colorway (D3's palette if it has none), counting on from the map's entries.
+    """
+    colorway = plotly.io.templates[template].layout.colorway or qualitative.D3
+    colors = dict(color_map)
+    for label in labels:
+        if label not in colors:
+            colors[label] = colorway[len(colors) % len(colorway)]
+    return [colors[label] for label in labels]
+
+
+def plotly_chart_json(spec, use_container_width=False, theme="streamlit"):
+    """``st.plotly_chart`` for a figure already serialised with ``figure_json``."""
+    proto = PlotlyChartProto()
+    proto.use_container_width = use_container_width
+    proto.figure.spec = spec
+    proto.figure.config = _DEFAULT_CONFIG
+    proto.theme = theme or ""
+    # The main DeltaGenerator enqueues into whichever container block is active.
+    return st._main._enqueue("plotly_chart", proto)
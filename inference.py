@@ -0,0 +1,412 @@
+"""Tests of the teaching-method effect on the subject scores.
+
+``manova`` runs a one-way MANOVA of the score columns on ``TeachingMethod``.
+The hypothesis (between-method) and error (within-method) SSCP matrices are
+built from per-method means and group-centred cross-products of the score
+block, and the four classical test statistics are reported with their F
+approximations, in the same layout statsmodels uses.
+
+The per-method counts, mean vectors and SSCP matrices are accumulated by
+``SSCPAccumulator`` one chunk at a time and merge across chunks and worker
+processes, so the test also runs over extracts streamed from disk
+(``manova_chunks``) with memory bounded by the chunk size.
+
+``permutation_test`` gives a distribution-free p-value for the same effect by
+shuffling the method labels.  A permutation costs one ``bincount`` per score
+column, and batches of permutations run in ``stats_engine``'s shared process
+pool with one seed per batch, so results don't depend on the number of workers.
+
+``bootstrap_ci`` resamples students within each method for percentile
+intervals around the mean scores that don't lean on the normal approximation:
+integer scores are resampled as multinomial draws from their histograms, other
+scores through the same batched, per-batch-seeded pool.
+
+``pairwise_comparisons`` follows up with Tukey HSD (Tukey-Kramer for unequal
+group sizes) or Games-Howell comparisons of every pair of methods within each
+subject, computed from the group means, variances and counts alone.
+"""
+import collections
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from stats_engine import factorize_labels, pool_map, score_histograms
+
+MANOVA_STATISTICS = ["Wilks' lambda", "Pillai's trace", "Hotelling-Lawley trace", "Roy's greatest root"]
+MANOVA_COLUMNS = ['Value', 'Num DF', 'Den DF', 'F Value', 'Pr > F']
+
+
+def _complete_block(df, value_columns, key):
+    # MANOVA needs complete cases: rows with a method and every score present.
+    block = df[value_columns].to_numpy(dtype=np.float64)
+    codes, methods = factorize_labels(df[key])
+    keep = (codes >= 0) & ~np.isnan(block).any(axis=1)
+    return codes[keep], np.asarray(methods), block[keep]
+
+
+def group_moments(codes, block, n_groups):
+    """Per-group counts, mean vectors and SSCP matrices (groups x p x p) of ``block``."""
+    p = block.shape[1]
+    counts = np.bincount(codes, minlength=n_groups)
+    means = np.full((n_groups, p), np.nan)
+    sscp = np.zeros((n_groups, p, p))
+    # One group's rows at a time, so memory stays proportional to the block.
+    order = np.argsort(codes, kind='stable')
+    ends = np.cumsum(counts)
+    for group in np.flatnonzero(counts):
+        rows = block[order[ends[group] - counts[group]:ends[group]]]
+        means[group] = rows.mean(axis=0)
+        rows -= means[group]
+        sscp[group] = rows.T @ rows
+    return counts, means, sscp
+
+
+class SSCPAccumulator:
+    """Streaming per-method counts, mean vectors and SSCP matrices for MANOVA.
+
+    ``update`` folds in a chunk of the wide sheet; ``merge`` combines
+    accumulators built over different chunks or in different processes, using
+    the multivariate form of Chan et al.'s pairwise update.  Once the data has
+    been seen, ``manova`` costs O(methods x subjects^2) regardless of its size.
+    """
+
+    def __init__(self, value_columns, key='TeachingMethod'):
+        self.value_columns = list(value_columns)
+        self.key = key
+        p = len(self.value_columns)
+        self.methods = np.empty(0, dtype=object)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.means = np.zeros((0, p))
+        self.sscp = np.zeros((0, p, p))
+
+    def _aligned(self, methods):
+        index = np.searchsorted(methods, self.methods)
+        p = len(self.value_columns)
+        counts = np.zeros(len(methods), dtype=np.int64)
+        means = np.zeros((len(methods), p))
+        sscp = np.zeros((len(methods), p, p))
+        counts[index], means[index], sscp[index] = self.counts, np.nan_to_num(self.means), self.sscp
+        return counts, means, sscp
+
+    def merge(self, other):
+        """Return the accumulator of the data behind both ``self`` and ``other``."""
+        methods = np.union1d(self.methods, other.methods).astype(object)
+        n_a, mean_a, sscp_a = self._aligned(methods)
+        n_b, mean_b, sscp_b = other._aligned(methods)
+        n = n_a + n_b
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(n > 0, n_a * n_b / n, 0.0)
+            share = np.where(n > 0, n_b / n, 0.0)
+        delta = mean_b - mean_a
+        merged = SSCPAccumulator(self.value_columns, self.key)
+        merged.methods = methods
+        merged.counts = n
+        merged.means = mean_a + delta * share[:, None]
+        merged.sscp = sscp_a + sscp_b + weight[:, None, None] * (delta[:, :, None] * delta[:, None, :])
+        return merged
+
+    def update(self, df):
+        """Fold a chunk of the wide sheet into the accumulator; returns ``self``."""
+        codes, methods, block = _complete_block(df, self.value_columns, self.key)
+        chunk = SSCPAccumulator(self.value_columns, self.key)
+        chunk.methods = methods.astype(object)
+        chunk.counts, chunk.means, chunk.sscp = group_moments(codes, block, len(methods))
+        merged = self.merge(chunk)
+        self.methods, self.counts, self.means, self.sscp = merged.methods, merged.counts, merged.means, merged.sscp
+        return self
+
+    def manova(self):
+        return manova_from_moments(self.counts, self.means, self.sscp.sum(axis=0))
+
+
+def manova_from_moments(counts, means, within):
+    """MANOVA table from per-group ``counts``, ``means`` (groups x variables) and
+    the within-group SSCP matrix ``within``."""
+    observed = counts > 0
+    counts, means = counts[observed], means[observed]
+    n, k, p = counts.sum(), len(counts), means.shape[1]
+    grand = counts @ means / n
+    deviations = means - grand
+    hypothesis = (deviations * counts[:, None]).T @ deviations
+
+    eigenvalues = np.linalg.eigvals(np.linalg.solve(within, hypothesis)).real
+    eigenvalues = np.clip(eigenvalues, 0, None)
+    q, v = k - 1, n - k
+    s = min(p, q)
+    m = (abs(p - q) - 1) / 2
+    r = (v - p - 1) / 2
+
+    rows = {}
+    wilks = np.prod(1 / (1 + eigenvalues))
+    t = np.sqrt((p * p * q * q - 4) / (p * p + q * q - 5)) if p * p + q * q - 5 > 0 else 1
+    df1 = p * q
+    df2 = (v - (p - q + 1) / 2) * t - (p * q - 2) / 2
+    root = wilks ** (1 / t)
+    rows["Wilks' lambda"] = (wilks, df1, df2, (1 - root) / root * df2 / df1)
+
+    pillai = np.sum(eigenvalues / (1 + eigenvalues))
+    df1, df2 = s * (2 * m + s + 1), s * (2 * r + s + 1)
+    rows["Pillai's trace"] = (pillai, df1, df2, df2 / df1 * pillai / (s - pillai))
+
+    lawley = np.sum(eigenvalues)
+    if r > 0:
+        b = (p + 2 * r) * (q + 2 * r) / 2 / (2 * r + 1) / (r - 1)
+        df1 = p * q
+        df2 = 4 + (p * q + 2) / (b - 1)
+        c = (df2 - 2) / 2 / r
+        f_value = df2 / df1 * lawley / c
+    else:
+        df1, df2 = s * (2 * m + s + 1), s * (s * r + 1)
+        f_value = df2 / df1 / s * lawley
+    rows["Hotelling-Lawley trace"] = (lawley, df1, df2, f_value)
+
+    roy = eigenvalues.max() if len(eigenvalues) else 0.0
+    df1 = max(p, q)
+    df2 = v - df1 + q
+    rows["Roy's greatest root"] = (roy, df1, df2, df2 / df1 * roy)
+
+    table = pd.DataFrame.from_dict(rows, orient='index', columns=MANOVA_COLUMNS[:-1]).loc[MANOVA_STATISTICS]
+    table['Pr > F'] = stats.f.sf(table['F Value'], table['Num DF'], table['Den DF'])
+    return table
+
+
+def manova(df, value_columns, key='TeachingMethod'):
+    """One-way MANOVA of ``value_columns`` on ``key``; one row per test statistic."""
+    return SSCPAccumulator(value_columns, key).update(df).manova()
+
+
+def manova_chunks(chunks, value_columns, key='TeachingMethod'):
+    """MANOVA over an iterable of wide-format chunks (e.g. ``iter_sheet_chunks``)."""
+    accumulator = SSCPAccumulator(value_columns, key)
+    for chunk in chunks:
+        accumulator.update(chunk)
+    return accumulator.manova()
+
+
+PermutationResult = collections.namedtuple(
+    'PermutationResult', ['statistic', 'p_value', 'null_distribution', 'n_permutations', 'seed'])
+
+PERMUTATION_BATCH = 100  # permutations per pool task, and per progress update
+PARALLEL_MIN_CELLS = 50_000_000  # scores x resamples below which the pool costs more than it saves
+
+
+def _whitened_groups(df, value_columns, key):
+    # With the total SSCP T = L L^T and Y = (X - mean) L^-T, Pillai's trace is
+    # sum_g |sum of Y over group g|^2 / n_g, so a permutation only needs group
+    # sums of Y.  Y is stored transposed, one contiguous row per variable.
+    codes, methods, block = _complete_block(df, value_columns, key)
+    centred = block - block.mean(axis=0)
+    cholesky = np.linalg.cholesky(centred.T @ centred)
+    whitened = np.ascontiguousarray(np.linalg.solve(cholesky, centred.T))
+    counts = np.bincount(codes)
+    # Methods left without complete rows are dropped from the codes.
+    codes = (np.cumsum(counts > 0) - 1)[codes]
+    return whitened, codes.astype(np.intp), counts[counts > 0]
+
+
+def _group_sums(whitened, codes, n_groups):
+    return np.stack([np.bincount(codes, weights=row, minlength=n_groups) for row in whitened], axis=-1)
+
+
+def _pillai(sums, counts):
+    return np.einsum('...kp,...kp->...', sums, sums / counts[:, None])
+
+
+def _permuted_statistics(arrays, n_permutations, seed_sequence):
+    # Shuffling the labels, not the rows, keeps each permutation to one pass of
+    # bincount per variable without copying the score block.
+    whitened, codes, counts = arrays
+    rng = np.random.default_rng(seed_sequence)
+    labels = codes.copy()
+    sums = np.empty((n_permutations, len(counts), len(whitened)))
+    for i in range(n_permutations):
+        rng.shuffle(labels)
+        sums[i] = _group_sums(whitened, labels, len(counts))
+    return _pillai(sums, counts)
+
+
+def _run_batches(kernel, arrays, total, batch_size, seed, workers, progress):
+    # Runs ``kernel(arrays, size, seed_sequence)`` over batches covering ``total``
+    # resamples with ``pool_map`` and returns the batch results in order.  Every
+    # batch has its own seed spawned from ``seed``, so results don't depend on
+    # ``workers``; small jobs stay in-process.
+    sizes = [min(batch_size, total - start) for start in range(0, total, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if arrays[0].size * total < PARALLEL_MIN_CELLS:
+        workers = 1
+    finished = 0
+
+    def done(i):
+        nonlocal finished
+        finished += sizes[i]
+        if progress:
+            progress(finished, total)
+
+    return pool_map(kernel, arrays, list(zip(sizes, seeds)), workers, done)
+
+
+def permutation_test(df, value_columns, key='TeachingMethod', n_permutations=10_000, seed=0,
+                     workers=None, progress=None):
+    """Permutation test of the method effect on Pillai's trace.
+
+    Batches of label permutations run through ``pool_map`` with ``workers``
+    processes (all cores by default; ``1``, or a small sheet, runs in-process).
+    Every batch has its own seed spawned from ``seed``, so the result is
+    reproducible for any worker count.  ``progress(done, total)`` is called as
+    permutations finish.
+    """
+    whitened, codes, counts = _whitened_groups(df, value_columns, key)
+    statistic = float(_pillai(_group_sums(whitened, codes, len(counts)), counts))
+
+    results = _run_batches(_permuted_statistics, [whitened, codes, counts], n_permutations,
+                           PERMUTATION_BATCH, seed, workers, progress)
+
+    null_distribution = np.concatenate(results) if results else np.empty(0)
+    # Tolerance for the observed labelling reappearing up to rounding.
+    exceed = np.count_nonzero(null_distribution >= statistic * (1 - 1e-12))
+    p_value = (exceed + 1) / (n_permutations + 1)
+    return PermutationResult(statistic, p_value, null_distribution, n_permutations, seed)
+
+
+BOOTSTRAP_BATCH_CELLS = 4_000_000  # resampled scores held in memory per batch
+
+
+def _bootstrap_groups(df, value_columns, key):
+    # Unlike the MANOVA, each score column keeps its own missing values, so the
+    # block is stored zero-filled next to a presence mask.
+    codes, methods = factorize_labels(df[key])
+    keep = codes >= 0
+    order = np.argsort(codes[keep], kind='stable')
+    block = df[value_columns].to_numpy(dtype=np.float64)[keep][order]
+    present = ~np.isnan(block)
+    counts = np.bincount(codes[keep], minlength=len(methods))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return np.where(present, block, 0.0), present.astype(np.float64), starts, counts, methods
+
+
+def _bootstrap_means(arrays, n_boot, seed_sequence):
+    # One index matrix per batch: row b of ``rows`` resamples every method's rows
+    # with replacement from that method's own slice.  An empty ``present`` means
+    # no score is missing, so each resample's counts are the group sizes.
+    block, present, starts, counts = arrays
+    rng = np.random.default_rng(seed_sequence)
+    group_sizes = np.repeat(counts, counts)
+    rows = np.repeat(starts, counts) + rng.integers(0, group_sizes, size=(n_boot, len(block)))
+    sums = np.add.reduceat(block[rows], starts, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if not present.size:
+            return sums / counts[:, None]
+        return sums / np.add.reduceat(present[rows], starts, axis=1)
+
+
+def _histogram_bootstrap_means(arrays, n_boot, seed_sequence):
+    # Resampling a group's n scores with replacement draws its histogram from a
+    # multinomial over the scores it has, so no row is touched.
+    counts, scores = arrays
+    rng = np.random.default_rng(seed_sequence)
+    n = counts.sum(axis=-1)
+    means = np.full((n_boot,) + n.shape, np.nan)
+    for group in zip(*np.nonzero(n)):
+        observed = counts[group] > 0
+        draws = rng.multinomial(n[group], counts[group][observed] / n[group], size=n_boot)
+        means[(slice(None),) + group] = draws @ scores[observed] / n[group]
+    return means
+
+
+def bootstrap_ci(df, value_columns, key='TeachingMethod', column_name='Subject', suffix='Score',
+                 n_boot=2000, seed=0, confidence=0.95, workers=None, histograms=None, progress=None):
+    """Percentile bootstrap confidence intervals for each method's mean score.
+
+    Students are resampled with replacement within each method.  For integer
+    scores the resamples are multinomial draws from each (method, subject)
+    histogram (``histograms``, built from ``df`` if not passed in), at a cost
+    set by the number of distinct scores rather than students.  Other scores
+    are resampled through index matrices in batches run with ``pool_map`` in
+    ``workers`` processes (all cores by default).  Every batch has its own seed
+    spawned from ``seed``, so the intervals are reproducible for any worker
+    count; ``progress(done, total)`` is called as batches finish.  Returns one
+    row per (``key``, ``column_name``), in ``describe_wide`` order, with
+    ``CILower`` and ``CIUpper``.
+    """
+    if histograms is None:
+        histograms = score_histograms(df, value_columns, key=key, suffix=suffix)
+    if histograms is not None:
+        methods = histograms.methods
+        arrays = [histograms.counts, histograms.scores.astype(np.float64)]
+        kernel = _histogram_bootstrap_means
+    else:
+        block, present, starts, counts, methods = _bootstrap_groups(df, value_columns, key)
+        non_empty = counts > 0
+        methods = np.asarray(methods)[non_empty]
+        if present.all():
+            present = np.empty(0)
+        arrays = [block, present, starts[non_empty], counts[non_empty]]
+        kernel = _bootstrap_means
+    batch_size = max(1, min(n_boot, BOOTSTRAP_BATCH_CELLS // max(arrays[0].size, 1)))
+    results = _run_batches(kernel, arrays, n_boot, batch_size, seed, workers, progress)
+
+    means = np.concatenate(results)  # (n_boot, method, subject)
+    tail = (1 - confidence) / 2
+    lower, upper = np.nanquantile(means, [tail, 1 - tail], axis=0)
+    labels = [column.replace(suffix, '') for column in value_columns]
+    order = sorted(range(len(labels)), key=labels.__getitem__)
+    return pd.DataFrame({
+        key: np.repeat(np.asarray(methods), len(labels)),
+        column_name: np.tile(np.asarray(labels)[order], len(methods)),
+        'CILower': lower[:, order].ravel(),
+        'CIUpper': upper[:, order].ravel(),
+    })
+
+
+POST_HOC_TESTS = {'tukey': "Tukey HSD", 'games-howell': "Games–Howell"}
+
+
+def pairwise_comparisons(summary, test='tukey', key='TeachingMethod', column_name='Subject'):
+    """All pairwise method comparisons per subject from a descriptive statistics table.
+
+    ``summary`` needs ``Count``, ``Mean`` and ``Variance`` per (``key``,
+    ``column_name``) row, as in ``descriptive_stats``; no raw scores are read.
+    ``test`` is ``'tukey'`` (pooled variance, Tukey-Kramer) or ``'games-howell'``
+    (unequal variances, Welch degrees of freedom).  Returns one row per
+    (subject, method pair) with the mean difference ``A - B`` and adjusted p-value.
+    """
+    if test not in POST_HOC_TESTS:
+        raise ValueError(f"Unknown post-hoc test {test!r}; expected one of {sorted(POST_HOC_TESTS)}")
+    table = summary[summary['Count'] > 1]
+    counts = table.pivot(index=column_name, columns=key, values='Count')
+    subjects, methods = counts.index.to_numpy(), counts.columns.to_numpy()
+    n = counts.to_numpy(dtype=np.float64)
+    means = table.pivot(index=column_name, columns=key, values='Mean').to_numpy()
+    variances = table.pivot(index=column_name, columns=key, values='Variance').to_numpy()
+
+    a, b = np.triu_indices(len(methods), k=1)
+    n_a, n_b = n[:, a], n[:, b]
+    var_a, var_b = variances[:, a], variances[:, b]
+    difference = means[:, a] - means[:, b]
+    groups = np.sum(~np.isnan(n), axis=1, keepdims=True)
+    if test == 'tukey':
+        dof = np.nansum(n, axis=1, keepdims=True) - groups
+        mse = np.nansum((n - 1) * variances, axis=1, keepdims=True) / dof
+        standard_error = np.sqrt(mse / 2 * (1 / n_a + 1 / n_b))
+        dof = np.broadcast_to(dof, difference.shape)
+    else:
+        share_a, share_b = var_a / n_a, var_b / n_b
+        standard_error = np.sqrt((share_a + share_b) / 2)
+        dof = (share_a + share_b) ** 2 / (share_a ** 2 / (n_a - 1) + share_b ** 2 / (n_b - 1))
+    q = np.abs(difference) / standard_error
+    valid = ~np.isnan(q)
+    p_value = np.full(q.shape, np.nan)
+    p_value[valid] = np.clip(stats.studentized_range.sf(
+        q[valid], np.broadcast_to(groups, q.shape)[valid], dof[valid]), 0, 1)
+
+    return pd.DataFrame({
+        column_name: np.repeat(subjects, len(a)),
+        'MethodA': np.tile(methods[a], len(subjects)),
+        'MethodB': np.tile(methods[b], len(subjects)),
+        'MeanDiff': difference.ravel(),
+        'q': q.ravel(),
+        'DF': dof.ravel(),
+        'p-adj': p_value.ravel(),
+    })
+
@@ -0,0 +1,134 @@
+"""One process-wide, read-only store for the data and everything derived from it.
+
+Streamlit runs every browser session in the same server process.  Values put
+here (the score sheet, the statistics cube, the tables behind each tab, test
+results) are built once per data version, by whichever session asks first, and
+the same objects are then handed to every session, so memory doesn't grow with
+the number of users.
+
+Sessions ``lease`` the data version they are showing.  Entries of a leased
+version are never evicted.  Entries of versions no session holds any more are
+dropped least-recently-used first once the store is over ``REGISTRY_MAX_BYTES``.
+
+Values are shared, not copied: callers must not mutate them.
+"""
+import collections
+import os
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+# Budget for entries of unleased data versions (TEACHING_REGISTRY_MB, default 512 MiB).
+REGISTRY_MAX_BYTES = int(float(os.environ.get("TEACHING_REGISTRY_MB", 512)) * 2 ** 20)
+
+
+def nbytes(value, _depth=0):
+    """Rough deep size of ``value`` in bytes: frames, arrays, strings and containers of them."""
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(value, pd.DataFrame) else usage)
+    if isinstance(value, np.ndarray):
+        if value.dtype == object and _depth < 3:
+            return value.nbytes + sum(nbytes(item, _depth + 1) for item in value.ravel())
+        return value.nbytes
+    if _depth >= 3:
+        return 0
+    if isinstance(value, dict):
+        return sum(nbytes(item, _depth + 1) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(item, _depth + 1) for item in value)
+    if hasattr(value, '__dict__'):
+        return sum(nbytes(item, _depth + 1) for item in vars(value).values())
+    return 0
+
+
+class Lease:
+    """A session's hold on one data version; released on ``release()`` or garbage collection."""
+
+    def __init__(self, registry, version):
+        self.version = version
+        self._finalizer = weakref.finalize(self, registry.release, version)
+
+    def release(self):
+        self._finalizer()
+
+
+class Registry:
+    """Values keyed by ``(data version, name)``, shared by every session.
+
+    ``get`` builds a missing value at most once, even when several sessions
+    ask for it at the same moment.  ``name`` is any hashable identifying the
+    value within its data version, e.g. ``('posthoc', 'tukey')``.
+    """
+
+    def __init__(self, max_bytes=REGISTRY_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()  # (version, name) -> (value, size), oldest use first
+        self._leases = collections.Counter()       # version -> number of live leases
+        self._building = {}                        # (version, name) -> lock held while building
+        self._lock = threading.Lock()
+
+    def lease(self, version):
+        with self._lock:
+            self._leases[version] += 1
+        return Lease(self, version)
+
+    def release(self, version):
+        with self._lock:
+            self._leases[version] -= 1
+            if self._leases[version] <= 0:
+                del self._leases[version]
+            self._evict()
+
+    def peek(self, version, name, default=None):
+        """The stored value, or ``default`` without building it."""
+        with self._lock:
+            entry = self._entries.get((version, name))
+            if entry is None:
+                return default
+            self._entries.move_to_end((version, name))
+            return entry[0]
+
+    def get(self, version, name, build):
+        """Return the value for ``(version, name)``, calling ``build()`` if it isn't stored."""
+        key = (version, name)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            with self._lock:
+                if key in self._entries:
+                    return self._entries[key][0]
+            value = build()
+            with self._lock:
+                self._entries[key] = (value, nbytes(value))
+                self._building.pop(key, None)
+                self._evict()
+        return value
+
+    def _evict(self):
+        # Called with the lock held; leased versions count towards the budget but are never evicted.
+        total = sum(size for _, size in self._entries.values())
+        for key in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if key[0] not in self._leases:
+                total -= self._entries.pop(key)[1]
+
+    def stats(self):
+        """Entry count, stored bytes and leases per version, for monitoring."""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': sum(size for _, size in self._entries.values()),
+                'leases': dict(self._leases),
+            }
+
+
+registry = Registry()
@@ -0,0 +1,136 @@
+"""The dashboard's aggregate tables as SQL over an embedded DuckDB database.
+
+Setting ``TEACHING_QUERY_ENGINE=duckdb`` makes the dashboard compute
+``descriptive_stats``, ``top_methods`` and ``overall_means`` here instead of
+with ``stats_engine``.  The sheet (the cached frame, whose memory-mapped or
+Parquet-backed columns DuckDB scans in place, or a Parquet sidecar file) is
+registered in an in-process, in-memory database; the subject columns are
+unpivoted and aggregated inside DuckDB on all cores, so the long melted frame
+never exists in pandas.  Results have the same columns, dtypes and row order
+as the ``stats_engine`` tables, so the plotting code doesn't change.
+
+DuckDB is an optional dependency (``pip install duckdb``) and is only imported
+when an ``SQLEngine`` is created.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from stats_engine import STAT_COLUMNS, Z_95
+
+QUERY_ENGINE = os.environ.get("TEACHING_QUERY_ENGINE", "numpy")
+
+
+def _duckdb():
+    try:
+        import duckdb
+    except ImportError as error:
+        raise ImportError("The DuckDB query engine needs the optional 'duckdb' package "
+                          "(pip install duckdb)") from error
+    return duckdb
+
+
+def _quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _literal(text):
+    return "'" + text.replace("'", "''") + "'"
+
+
+class SQLEngine:
+    """Aggregate tables for a wide score sheet, computed by DuckDB.
+
+    ``source`` is a DataFrame or the path of a Parquet file holding ``key``
+    and ``value_columns``.  ``threads`` caps DuckDB's worker threads (all
+    cores by default).
+    """
+
+    def __init__(self, source, value_columns, key='TeachingMethod', column_name='Subject', suffix='Score',
+                 threads=None):
+        self.value_columns = list(value_columns)
+        self.key = key
+        self.column_name = column_name
+        self.connection = _duckdb().connect(':memory:')
+        if threads:
+            self.connection.execute(f"SET threads = {int(threads)}")
+        if isinstance(source, pd.DataFrame):
+            self.connection.register('sheet', source[[key] + self.value_columns])
+        else:
+            self.connection.execute(f"CREATE VIEW sheet AS SELECT * FROM read_parquet({_literal(os.fspath(source))})")
+
+        kinds = [dtype.kind for dtype in self.connection.execute(
+            f"SELECT {', '.join(map(_quote, self.value_columns))} FROM sheet LIMIT 0").df().dtypes]
+        self._integer_scores = all(kind in 'iu' for kind in kinds)
+
+        key, label = _quote(key), _quote(column_name)
+        # Categorical methods arrive as ENUMs; VARCHAR keeps the lexicographic group order.
+        # Missing scores stay in as NULLs, so a group without any scores still gets a row.
+        self.connection.execute(f"""
+            CREATE VIEW scores AS
+            SELECT {key}::VARCHAR AS method, replace(name, {_literal(suffix)}, '') AS label, value AS score
+            FROM (SELECT {key}, {', '.join(map(_quote, self.value_columns))} FROM sheet)
+                 UNPIVOT INCLUDE NULLS (value FOR name IN ({', '.join(map(_quote, self.value_columns))}))
+            WHERE {key} IS NOT NULL
+        """)
+        # Ties in the mode resolve to the smallest score, as Series.mode().iloc[0] does.
+        self.connection.execute(f"""
+            CREATE VIEW descriptive_stats AS
+            WITH summary AS (
+                SELECT method, label,
+                       count(score) AS n,
+                       avg(score) AS mean,
+                       quantile_cont(score, 0.5) AS median,
+                       stddev_samp(score) AS sd,
+                       var_samp(score) AS variance,
+                       max(score)::DOUBLE - min(score)::DOUBLE AS spread,
+                       quantile_cont(score, 0.75) - quantile_cont(score, 0.25) AS iqr
+                FROM scores GROUP BY method, label
+            ), modes AS (
+                SELECT method, label, score AS mode
+                FROM (SELECT method, label, score, count(score) AS n FROM scores GROUP BY method, label, score)
+                QUALIFY row_number() OVER (PARTITION BY method, label ORDER BY n DESC, score NULLS LAST) = 1
+            )
+            SELECT summary.method AS {key}, summary.label AS {label},
+                   n AS "Count", mean AS "Mean", median AS "Median", mode::DOUBLE AS "Mode",
+                   sd AS "StdDev", variance AS "Variance", spread AS "Range", iqr AS "IQR",
+                   {Z_95} * sd / sqrt(n) AS "CI"
+            FROM summary JOIN modes USING (method, label)
+        """)
+
+    def _typed(self, frame):
+        # Same dtypes as the stats_engine tables: integer scores give integer Mode and Range.
+        frame['Count'] = frame['Count'].astype(np.int64)
+        for column in ('Mode', 'Range'):
+            if self._integer_scores and not frame[column].isna().any():
+                frame[column] = frame[column].astype(np.int64)
+        return frame
+
+    def descriptive_stats(self):
+        """The ``describe_wide`` table: ``STAT_COLUMNS`` per (method, subject)."""
+        key, label = _quote(self.key), _quote(self.column_name)
+        frame = self.connection.execute(
+            f"SELECT * FROM descriptive_stats ORDER BY {key}, {label}").df()
+        return self._typed(frame[[self.key, self.column_name] + STAT_COLUMNS])
+
+    def top_methods(self):
+        """The method with the highest mean score in each subject, ordered by subject."""
+        key, label = _quote(self.key), _quote(self.column_name)
+        frame = self.connection.execute(f"""
+            SELECT * FROM descriptive_stats
+            QUALIFY row_number() OVER (PARTITION BY {label} ORDER BY "Mean" DESC NULLS LAST, {key}) = 1
+            ORDER BY {label}
+        """).df()
+        return self._typed(frame[[self.key, self.column_name] + STAT_COLUMNS])
+
+    def overall_means(self):
+        """Mean of all of each method's scores, as ``key`` and ``Score``."""
+        frame = self.connection.execute(f"""
+            SELECT method AS {_quote(self.key)}, avg(score) AS "Score"
+            FROM scores GROUP BY method ORDER BY method
+        """).df()
+        return frame
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,1127 @@
+"""Vectorised descriptive statistics for the dashboard's score groups.
+
+``describe_long`` is a drop-in replacement for the pandas ``groupby(...).agg``
+with ``mode``/``range``/``IQR`` lambdas: every statistic is computed for all
+groups at once from one sort of the scores, with no per-group Python calls.
+Quantiles use the same linear interpolation as ``Series.quantile`` and ties in
+the mode resolve to the smallest value, as ``Series.mode().iloc[0]`` does.
+
+``describe_wide`` produces the same table straight from the wide sheet, one
+score column at a time, so the dashboard never builds the long melted frame
+(five rows and a ``Subject`` string per student).
+
+When every score column holds integers within ``MAX_HISTOGRAM_BINS`` of each
+other, the sort is skipped altogether: ``score_histograms`` counts each
+(method, subject, score) combination with ``np.bincount`` and every statistic,
+quantiles and mode included, is read off those histograms.  The histograms are
+kept on the result so distribution views need no further pass over the data;
+``binned_scores`` gives the same views equal-width bins and sort-based box-plot
+statistics for scores that aren't whole numbers.
+
+``GroupState`` holds the same statistics as mergeable partial aggregates, so
+shards of the data can be summarised independently and combined afterwards.
+``IncrementalStats`` uses that to fold newly appended students into stored
+aggregates instead of recomputing the whole table, and ``StatsCube`` lays the
+same statistics out over (method, extra dimensions, subject) with roll-ups.  Scores that don't fit a
+histogram can opt into ``QuantileSketch`` summaries (``QUANTILE_ERROR``), which
+give approximate medians and IQRs in bounded memory.
+
+``parallel_state`` builds a ``GroupState`` of a large sheet in a process pool:
+``pool_map`` copies the score columns once into shared memory, each worker
+summarises a range of rows, and the shard states are merged.  The resampling
+tests in ``inference`` run their batches through the same pool.
+"""
+import functools
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+Z_95 = 1.96
+MAX_HISTOGRAM_BINS = 1024  # widest integer score span summarised by histograms
+# Normalised rank error of approximate medians/IQRs for non-integer scores; unset keeps them exact.
+QUANTILE_ERROR = float(os.environ["TEACHING_QUANTILE_ERROR"]) if os.environ.get("TEACHING_QUANTILE_ERROR") else None
+APPROXIMATE_COLUMNS = ['Median', 'IQR']
+# Worker processes for building group states; unset uses every core.
+STATS_WORKERS = int(os.environ["TEACHING_STATS_WORKERS"]) if os.environ.get("TEACHING_STATS_WORKERS") else None
+PARALLEL_MIN_ROWS = 500_000  # below this, starting worker processes costs more than it saves
+DISTRIBUTION_BINS = 40  # bins per subject for distributions of non-integer scores
+STAT_COLUMNS = ['Count', 'Mean', 'Median', 'Mode', 'StdDev', 'Variance', 'Range', 'IQR', 'CI']
+
+
+def _quantile(sorted_values, starts, counts, q):
+    position = (counts - 1) * q
+    below = np.floor(position).astype(np.int64)
+    above = np.ceil(position).astype(np.int64)
+    lo = sorted_values[starts + below].astype(np.float64)
+    hi = sorted_values[starts + above].astype(np.float64)
+    if q == 0.5:
+        return (lo + hi) / 2
+    return lo + (hi - lo) * (position - below)
+
+
+def _modes(sorted_codes, sorted_values, n_groups):
+    # Runs of equal (group, value) in the sorted data; the longest run per group
+    # wins and, among equally long runs, the first (smallest value).
+    new_run = np.ones(len(sorted_values), dtype=bool)
+    new_run[1:] = (sorted_codes[1:] != sorted_codes[:-1]) | (sorted_values[1:] != sorted_values[:-1])
+    run_starts = np.flatnonzero(new_run)
+    run_lengths = np.diff(np.append(run_starts, len(sorted_values)))
+    run_groups = sorted_codes[run_starts]
+    best = np.lexsort((run_starts, -run_lengths, run_groups))
+    groups, first = np.unique(run_groups[best], return_index=True)
+    modes = np.full(n_groups, np.nan)
+    modes[groups] = sorted_values[run_starts[best[first]]]
+    return modes
+
+
+def group_stats(codes, values, n_groups):
+    """Return a dict of per-group statistic arrays for integer group ``codes``.
+
+    ``codes`` holds values in ``range(n_groups)``; NaN ``values`` are ignored.
+    Groups without any value get a zero count and NaN statistics.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        present = ~np.isnan(values)
+        codes, values = codes[present], values[present]
+
+    counts = np.bincount(codes, minlength=n_groups)
+    order = np.lexsort((values, codes))
+    sorted_codes, sorted_values = codes[order], values[order]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    observed = counts > 0
+    ends = starts + counts - 1
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(codes, weights=values, minlength=n_groups) / counts
+        deviations = values - mean[codes]
+        variance = np.bincount(codes, weights=deviations * deviations, minlength=n_groups) / (counts - 1)
+    variance[counts < 2] = np.nan
+
+    median = np.full(n_groups, np.nan)
+    iqr = np.full(n_groups, np.nan)
+    value_range = np.full(n_groups, np.nan)
+    s, c = starts[observed], counts[observed]
+    median[observed] = _quantile(sorted_values, s, c, 0.5)
+    iqr[observed] = _quantile(sorted_values, s, c, 0.75) - _quantile(sorted_values, s, c, 0.25)
+    value_range[observed] = sorted_values[ends[observed]] - sorted_values[s]
+
+    std = np.sqrt(variance)
+    return {
+        'Count': counts,
+        'Mean': mean,
+        'Median': median,
+        'Mode': _modes(sorted_codes, sorted_values, n_groups),
+        'StdDev': std,
+        'Variance': variance,
+        'Range': value_range,
+        'IQR': iqr,
+        'CI': Z_95 * std / np.sqrt(counts),
+    }
+
+
+def _as_value_dtype(column, dtype):
+    # Integer scores give integer Mode and Range, as the pandas lambdas did.
+    if dtype.kind in 'iu' and not np.isnan(column).any():
+        return column.astype(np.int64)
+    return column
+
+
+def describe_long(df, keys=('TeachingMethod', 'Subject'), value='Score'):
+    """Descriptive statistics of ``value`` per ``keys`` group of a long-format frame.
+
+    Returns the same frame (columns, row order, observed groups only) as the
+    previous ``groupby(keys).agg(...).reset_index()`` plus the ``CI`` column.
+    """
+    keys = list(keys)
+    codes = np.zeros(len(df), dtype=np.int64)
+    keep = np.ones(len(df), dtype=bool)
+    levels = []
+    for key in keys:
+        key_codes, uniques = factorize_labels(df[key])
+        keep &= key_codes >= 0  # groupby drops rows with a missing key
+        codes = codes * len(uniques) + key_codes
+        levels.append(uniques)
+    n_groups = int(np.prod([len(u) for u in levels])) if levels else 1
+
+    codes = codes[keep]
+    values = df[value].to_numpy()[keep]
+    stats = group_stats(codes, values, n_groups)
+    groups = np.flatnonzero(np.bincount(codes, minlength=n_groups))
+
+    result = {}
+    remainder = groups
+    for key, uniques, size in reversed(list(zip(keys, levels, [len(u) for u in levels]))):
+        remainder, key_codes = np.divmod(remainder, size)
+        result[key] = np.asarray(uniques)[key_codes]
+    return _frame({key: result[key] for key in keys}, stats, groups, values.dtype)
+
+
+def _frame(keys, stats, groups, value_dtype):
+    frame = pd.DataFrame(keys)
+    for column in STAT_COLUMNS:
+        frame[column] = stats[column][groups]
+    for column in ('Mode', 'Range'):
+        frame[column] = _as_value_dtype(frame[column].to_numpy(), value_dtype)
+    return frame
+
+
+def describe_wide(df, value_columns, key='TeachingMethod', column_name='Subject', suffix='Score',
+                  engine='auto', histograms=None):
+    """Descriptive statistics per (``key``, score column) straight from a wide frame.
+
+    Equivalent to melting ``value_columns`` into ``column_name`` (with ``suffix``
+    stripped from the labels) and calling ``describe_long``, without the melt.
+
+    ``engine`` is ``'sort'``, ``'histogram'`` or ``'auto'`` (histograms whenever
+    the scores allow them).  Already built ``histograms`` can be passed in.
+    """
+    if engine not in ('auto', 'sort', 'histogram'):
+        raise ValueError(f"Unknown statistics engine {engine!r}")
+    labels = [column.replace(suffix, '') for column in value_columns]
+    value_dtype = np.result_type(*[df[column].dtype for column in value_columns])
+    if engine != 'sort' and histograms is None:
+        histograms = score_histograms(df, value_columns, key=key, suffix=suffix)
+        if histograms is None and engine == 'histogram':
+            raise ValueError("Scores are not integers within a histogram-sized range")
+
+    if engine != 'sort' and histograms is not None:
+        methods = histograms.methods
+        flat = histograms.stats()
+        per_column = [{name: flat[name].reshape(len(methods), -1)[:, j] for name in flat}
+                      for j in range(len(labels))]
+    else:
+        key_codes, methods, present = _method_codes(df, key)
+        per_column = [group_stats(key_codes, df[column].to_numpy()[present], len(methods))
+                      for column in value_columns]
+
+    stats = {name: np.column_stack([column[name] for column in per_column]) for name in STAT_COLUMNS}
+    return _wide_frame(stats, methods, labels, value_dtype, key, column_name)
+
+
+def _wide_frame(stats, methods, labels, value_dtype, key, column_name):
+    # ``stats`` arrays are shaped (method, subject); rows come out ordered by
+    # (method, subject label), as groupby on the long frame sorts them.
+    order = sorted(range(len(labels)), key=labels.__getitem__)
+    flat = {name: np.asarray(stats[name])[:, order].ravel() for name in STAT_COLUMNS}
+    groups = np.arange(len(methods) * len(labels))
+    keys = {
+        key: np.repeat(np.asarray(methods), len(labels)),
+        column_name: np.tile(np.asarray(labels)[order], len(methods)),
+    }
+    return _frame(keys, flat, groups, value_dtype)
+
+
+def integer_range(columns):
+    """Return ``(lo, hi)`` if all ``columns`` hold integers spanning at most
+    ``MAX_HISTOGRAM_BINS`` values (NaN allowed), otherwise ``None``."""
+    lo, hi = None, None
+    for values in columns:
+        if values.dtype.kind == 'f':
+            values = values[~np.isnan(values)]
+            if not np.array_equal(values, np.floor(values)):
+                return None
+        elif values.dtype.kind not in 'iu':
+            return None
+        if len(values):
+            col_lo, col_hi = values.min(), values.max()
+            lo = col_lo if lo is None else min(lo, col_lo)
+            hi = col_hi if hi is None else max(hi, col_hi)
+    if lo is None:
+        return None
+    lo, hi = int(lo), int(hi)
+    return (lo, hi) if hi - lo < MAX_HISTOGRAM_BINS else None
+
+
+def _order_statistic(cumulative, lo, rank):
+    # Score of the rank-th (0-based) smallest value in each histogram.
+    return lo + (cumulative > rank[..., None]).argmax(axis=-1).astype(np.float64)
+
+
+def histogram_quantile(counts, lo, q, cumulative=None):
+    """The ``q`` quantile of each histogram in ``counts`` (bins on the last axis).
+
+    Interpolates linearly, as ``Series.quantile`` does; empty histograms give NaN.
+    ``cumulative`` optionally passes in ``counts.cumsum(axis=-1)``.
+    """
+    if cumulative is None:
+        cumulative = np.asarray(counts).cumsum(axis=-1)
+    n = cumulative[..., -1]
+    position = (n - 1) * q
+    below, above = np.floor(position), np.ceil(position)
+    low, high = _order_statistic(cumulative, lo, below), _order_statistic(cumulative, lo, above)
+    if q == 0.5:
+        result = (low + high) / 2
+    else:
+        result = low + (high - low) * (position - below)
+    return np.where(n > 0, result, np.nan)
+
+
+def histogram_stats(counts, lo):
+    """Per-group statistics from integer histograms.
+
+    ``counts[g, i]`` is the number of scores equal to ``lo + i`` in group ``g``.
+    Returns the same dict of arrays as ``group_stats``.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    n_bins = counts.shape[1]
+    scores = lo + np.arange(n_bins, dtype=np.float64)
+    n = counts.sum(axis=1)
+    observed = n > 0
+    cumulative = counts.cumsum(axis=1)
+
+    def quantile(q):
+        return histogram_quantile(counts, lo, q, cumulative)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = counts @ scores / n
+        variance = (counts * (scores[None, :] - mean[:, None]) ** 2).sum(axis=1) / (n - 1)
+    variance[n < 2] = np.nan
+    nonzero = counts > 0
+    minimum = nonzero.argmax(axis=1)
+    maximum = n_bins - 1 - nonzero[:, ::-1].argmax(axis=1)
+
+    std = np.sqrt(variance)
+    stats = {
+        'Count': n,
+        'Mean': mean,
+        'Median': quantile(0.5),
+        'Mode': lo + counts.argmax(axis=1).astype(np.float64),
+        'StdDev': std,
+        'Variance': variance,
+        'Range': (maximum - minimum).astype(np.float64),
+        'IQR': quantile(0.75) - quantile(0.25),
+        'CI': Z_95 * std / np.sqrt(n),
+    }
+    for name in ('Median', 'Mode', 'Range', 'IQR'):
+        stats[name][~observed] = np.nan
+    return stats
+
+
+class ScoreHistograms:
+    """Integer score histograms per (method, subject) group.
+
+    ``counts[m, s, i]`` is the number of students taught with ``methods[m]`` who
+    scored ``lo + i`` in ``subjects[s]``.
+    """
+
+    def __init__(self, counts, lo, methods, subjects):
+        self.counts = counts
+        self.lo = lo
+        self.methods = methods
+        self.subjects = subjects
+
+    @property
+    def scores(self):
+        return self.lo + np.arange(self.counts.shape[-1])
+
+    def bins(self, subject):
+        """Bin centres and width for ``counts[:, subject]``: one bin per score."""
+        return self.scores, 1
+
+    def stats(self):
+        n_methods, n_subjects, n_bins = self.counts.shape
+        return histogram_stats(self.counts.reshape(n_methods * n_subjects, n_bins), self.lo)
+
+    def box_stats(self):
+        """Box-plot statistics per (method, subject), as arrays shaped (method, subject).
+
+        ``q1``, ``median`` and ``q3`` interpolate as ``Series.quantile``; the
+        fences are the most extreme scores within 1.5 IQR of the quartiles, where
+        plotly draws the whiskers.  Empty groups are NaN throughout.
+        """
+        cumulative = self.counts.cumsum(axis=-1)
+        n = cumulative[..., -1]
+        q1, median, q3 = (histogram_quantile(self.counts, self.lo, q, cumulative) for q in (0.25, 0.5, 0.75))
+        scores = self.scores.astype(np.float64)
+        present = self.counts > 0
+        with np.errstate(invalid='ignore'):
+            inside_low = present & (scores >= (q1 - 1.5 * (q3 - q1))[..., None])
+            inside_high = present & (scores <= (q3 + 1.5 * (q3 - q1))[..., None])
+            mean = self.counts @ scores / n
+        empty = n == 0
+        lowerfence = np.where(empty, np.nan, scores[inside_low.argmax(axis=-1)])
+        upperfence = np.where(empty, np.nan, scores[::-1][inside_high[..., ::-1].argmax(axis=-1)])
+        return {'q1': q1, 'median': median, 'q3': q3, 'lowerfence': lowerfence,
+                'upperfence': upperfence, 'mean': mean}
+
+
+def factorize_labels(values):
+    """``pd.factorize(values, sort=True)``, with the labels always in lexicographic order.
+
+    Categorical columns are read from their codes without hashing the labels;
+    categories that never occur are dropped, as factorize would, and the
+    category order (a display concern) doesn't leak into the group order that
+    ``GroupState.merge`` relies on.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        categories = values.cat.categories.to_numpy()
+        used = np.bincount(codes[codes >= 0], minlength=len(categories)) > 0
+        order = np.array([i for i in np.argsort(categories) if used[i]], dtype=np.int64)
+        remap = np.full(len(categories) + 1, -1, dtype=np.int64)  # the extra slot keeps -1 (missing) as -1
+        remap[order] = np.arange(len(order))
+        return remap[codes], categories[order]
+    codes, uniques = pd.factorize(values, sort=True)
+    return codes, np.asarray(uniques)
+
+
+def _method_codes(df, key):
+    codes, methods = factorize_labels(df[key])
+    present = codes >= 0
+    return codes[present], np.asarray(methods), present
+
+
+def score_histograms(df, value_columns, key='TeachingMethod', suffix='Score'):
+    """Build ``ScoreHistograms`` for a wide frame, or ``None`` if scores aren't
+    integers in a range narrow enough for histograms."""
+    key_codes, methods, present = _method_codes(df, key)
+    columns = [df[column].to_numpy()[present] for column in value_columns]
+    subjects = [column.replace(suffix, '') for column in value_columns]
+    return _histograms(key_codes, methods, columns, subjects)
+
+
+def _histograms(key_codes, methods, columns, subjects):
+    bounds = integer_range(columns)
+    if bounds is None:
+        return None
+    lo, hi = bounds
+    n_bins = hi - lo + 1
+    counts = np.zeros((len(methods), len(columns), n_bins), dtype=np.int64)
+    for j, values in enumerate(columns):
+        codes = key_codes
+        if values.dtype.kind == 'f':
+            valid = ~np.isnan(values)
+            codes, values = codes[valid], values[valid]
+        combined = codes * n_bins + (values.astype(np.int64) - lo)
+        counts[:, j, :] = np.bincount(combined, minlength=len(methods) * n_bins).reshape(len(methods), n_bins)
+    return ScoreHistograms(counts, lo, methods, subjects)
+
+
+class BinnedScores:
+    """Histograms and box-plot statistics of scores that aren't whole numbers.
+
+    The counterpart of ``ScoreHistograms`` for distribution views: ``counts[m,
+    s, b]`` is the number of students taught with ``methods[m]`` whose score in
+    ``subjects[s]`` falls in bin ``b`` of ``edges[s]`` (equal-width bins over
+    that subject's observed range), and ``box_stats`` returns quartiles, fences
+    and means computed from the sorted scores.
+    """
+
+    def __init__(self, counts, edges, methods, subjects, box):
+        self.counts = counts
+        self.edges = edges
+        self.methods = methods
+        self.subjects = subjects
+        self._box = box
+
+    def bins(self, subject):
+        """Bin centres and width for ``counts[:, subject]``."""
+        edges = self.edges[subject]
+        return (edges[:-1] + edges[1:]) / 2, edges[1] - edges[0]
+
+    def box_stats(self):
+        """Box-plot statistics as in ``ScoreHistograms.box_stats``, arrays shaped (method, subject)."""
+        return self._box
+
+
+def sorted_box_stats(codes, values, n_groups):
+    """``ScoreHistograms.box_stats`` for raw ``values`` grouped by ``codes``, one entry per group.
+
+    NaN ``values`` are ignored; empty groups are NaN throughout.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    present = ~np.isnan(values)
+    codes, values = codes[present], values[present]
+    counts = np.bincount(codes, minlength=n_groups)
+    sorted_values = values[np.lexsort((values, codes))]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    box = {name: np.full(n_groups, np.nan) for name in ('q1', 'median', 'q3', 'lowerfence', 'upperfence')}
+    observed = counts > 0
+    s, c = starts[observed], counts[observed]
+    for name, q in (('q1', 0.25), ('median', 0.5), ('q3', 0.75)):
+        box[name][observed] = _quantile(sorted_values, s, c, q)
+    for group in np.flatnonzero(observed):
+        scores = sorted_values[starts[group]:starts[group] + counts[group]]
+        spread = 1.5 * (box['q3'][group] - box['q1'][group])
+        box['lowerfence'][group] = scores[np.searchsorted(scores, box['q1'][group] - spread, side='left')]
+        box['upperfence'][group] = scores[np.searchsorted(scores, box['q3'][group] + spread, side='right') - 1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        box['mean'] = np.bincount(codes, weights=values, minlength=n_groups) / counts
+    return box
+
+
+def binned_scores(df, value_columns, key='TeachingMethod', suffix='Score', bins=DISTRIBUTION_BINS):
+    """``BinnedScores`` of a wide frame, with ``bins`` equal-width bins per score column."""
+    key_codes, methods, present = _method_codes(df, key)
+    subjects = [column.replace(suffix, '') for column in value_columns]
+    counts = np.zeros((len(methods), len(value_columns), bins), dtype=np.int64)
+    edges = np.empty((len(value_columns), bins + 1))
+    box = {}
+    for j, column in enumerate(value_columns):
+        values = df[column].to_numpy(dtype=np.float64)[present]
+        valid = ~np.isnan(values)
+        codes, scores = key_codes[valid], values[valid]
+        edges[j] = np.histogram_bin_edges(scores, bins=bins)
+        # The last bin is closed on the right, as in np.histogram.
+        index = np.clip(np.searchsorted(edges[j], scores, side='right') - 1, 0, bins - 1)
+        counts[:, j, :] = np.bincount(codes * bins + index, minlength=len(methods) * bins).reshape(len(methods), bins)
+        for name, stat in sorted_box_stats(codes, scores, len(methods)).items():
+            box.setdefault(name, np.empty((len(methods), len(value_columns))))[:, j] = stat
+    return BinnedScores(counts, edges, methods, subjects, box)
+
+
+class QuantileSketch:
+    """Mergeable KLL quantile sketch (Karnin, Lang & Liberty, 2016).
+
+    Keeps a stack of compactors whose capacities shrink geometrically towards the
+    lowest level; an item at level ``h`` stands for ``2 ** h`` inputs.  Memory is
+    ``O(k)`` regardless of how many values are added, and the normalised rank
+    error of a quantile is roughly ``error`` (see ``k_for_error``).
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    @staticmethod
+    def k_for_error(error):
+        # Empirical single-quantile bound of KLL sketches: error ~ 2.296 / k ** 0.9723.
+        return max(8, math.ceil((2.296 / error) ** (1 / 0.9723)))
+
+    @classmethod
+    def for_error(cls, error, seed=None):
+        return cls(cls.k_for_error(error), seed=seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, math.ceil(self.k * (2 / 3) ** depth))
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) <= self._capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(items)
+            # An odd item out stays behind; every other remaining item moves up a level.
+            keep = items[:len(items) % 2]
+            items = items[len(items) % 2:]
+            promoted = items[self._rng.integers(2)::2]
+            self.levels[level] = keep
+            self.levels[level + 1] = np.concatenate((self.levels[level + 1], promoted))
+            level = 0  # capacities shift when the stack grows
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.levels[0] = np.concatenate((self.levels[0], values))
+            self.n += len(values)
+            self._compress()
+        return self
+
+    def merge(self, other):
+        """Return a sketch of the union of both inputs."""
+        merged = QuantileSketch(max(self.k, other.k))
+        merged._rng = self._rng
+        depth = max(len(self.levels), len(other.levels))
+        merged.levels = [
+            np.concatenate([levels[h] for levels in (self.levels, other.levels) if h < len(levels)])
+            for h in range(depth)
+        ]
+        merged.n = self.n + other.n
+        merged._compress()
+        return merged
+
+    def quantile(self, q):
+        if self.n == 0:
+            return np.nan
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        cumulative = np.cumsum(weights[order])
+        index = np.searchsorted(cumulative, q * cumulative[-1], side='left')
+        return items[order][min(index, len(items) - 1)]
+
+
+def _sketch_grid(key_codes, n_methods, columns, error):
+    # One sketch per (method, column): split each column by method with one sort.
+    grid = np.empty((n_methods, len(columns)), dtype=object)
+    for j, values in enumerate(columns):
+        order = np.argsort(key_codes, kind='stable')
+        bounds = np.cumsum(np.bincount(key_codes, minlength=n_methods))[:-1]
+        for m, part in enumerate(np.split(np.asarray(values, dtype=np.float64)[order], bounds)):
+            grid[m, j] = QuantileSketch.for_error(error, seed=(m, j)).update(part)
+    return grid
+
+
+def _sketches_from_histograms(histograms, error):
+    n_methods, n_subjects, _ = histograms.counts.shape
+    grid = np.empty((n_methods, n_subjects), dtype=object)
+    for m in range(n_methods):
+        for j in range(n_subjects):
+            values = np.repeat(histograms.scores, histograms.counts[m, j])
+            grid[m, j] = QuantileSketch.for_error(error, seed=(m, j)).update(values)
+    return grid
+
+
+def _summary_stats(count, mean, m2, minimum, maximum, histograms=None, lo=None, sketches=None):
+    # Statistic arrays shaped like ``count`` from sufficient statistics of any shape;
+    # ``histograms`` has one extra trailing axis of score bins starting at ``lo``.
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = np.where(count > 1, m2 / (count - 1), np.nan)
+        std = np.sqrt(variance)
+        stats = {
+            'Count': count,
+            'Mean': mean,
+            'StdDev': std,
+            'Variance': variance,
+            'Range': np.where(count > 0, maximum - minimum, np.nan),
+            'CI': Z_95 * std / np.sqrt(count),
+        }
+    shape = count.shape
+    if histograms is not None:
+        exact = histogram_stats(histograms.reshape(-1, histograms.shape[-1]), lo)
+        for name in ('Median', 'Mode', 'IQR'):
+            stats[name] = exact[name].reshape(shape)
+    else:
+        for name in ('Median', 'Mode', 'IQR'):
+            stats[name] = np.full(shape, np.nan)
+        if sketches is not None:
+            quantiles = np.vectorize(lambda sketch, q: sketch.quantile(q), otypes=[np.float64])
+            stats['Median'] = quantiles(sketches, 0.5)
+            stats['IQR'] = quantiles(sketches, 0.75) - quantiles(sketches, 0.25)
+    return stats
+
+
+class GroupState:
+    """Mergeable sufficient statistics for every (method, subject) group.
+
+    Arrays are shaped ``(len(methods), len(subjects))``: ``count``, ``mean``,
+    ``m2`` (sum of squared deviations from the mean), ``minimum`` and
+    ``maximum``.  Integer scores also carry ``histograms``, which keep medians,
+    modes and quantiles exact through any number of merges.  Other scores can
+    carry a grid of ``QuantileSketch`` objects (``sketches``) instead, giving
+    approximate medians and IQRs within ``quantile_error`` rank error.
+
+    States built independently from shards of the data (per school, per term
+    file, per chunk) combine with ``merge`` into the state of all of it; means
+    and ``m2`` are combined with Chan et al.'s pairwise update.
+    """
+
+    def __init__(self, methods, subjects, count, mean, m2, minimum, maximum,
+                 histograms=None, dtype=np.dtype(np.float64), sketches=None, quantile_error=None):
+        self.methods = np.asarray(methods)
+        self.subjects = list(subjects)
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.minimum = minimum
+        self.maximum = maximum
+        self.histograms = histograms
+        self.dtype = np.dtype(dtype)
+        self.sketches = sketches
+        self.quantile_error = quantile_error
+
+    @classmethod
+    def from_frame(cls, df, value_columns, key='TeachingMethod', suffix='Score', quantile_error=None):
+        """State of one wide-format shard.
+
+        ``quantile_error`` enables quantile sketches for scores that don't fit a histogram.
+        """
+        key_codes, methods, present = _method_codes(df, key)
+        columns = [df[column].to_numpy()[present] for column in value_columns]
+        subjects = [column.replace(suffix, '') for column in value_columns]
+        dtype = np.result_type(*[df[column].dtype for column in value_columns])
+        return cls.from_codes(key_codes, methods, columns, subjects, dtype, quantile_error)
+
+    @classmethod
+    def from_codes(cls, key_codes, methods, columns, subjects, dtype, quantile_error=None):
+        """State of score ``columns`` grouped by ``key_codes`` indexing into ``methods``."""
+        histograms = _histograms(key_codes, methods, columns, subjects)
+        if histograms is not None:
+            state = cls.from_histograms(histograms, dtype=dtype)
+            state.quantile_error = quantile_error
+            return state
+
+        shape = (len(methods), len(columns))
+        count = np.zeros(shape, dtype=np.int64)
+        mean = np.full(shape, np.nan)
+        m2 = np.zeros(shape)
+        minimum = np.full(shape, np.inf)
+        maximum = np.full(shape, -np.inf)
+        for j, values in enumerate(columns):
+            codes = key_codes
+            if values.dtype.kind == 'f':
+                valid = ~np.isnan(values)
+                codes, values = codes[valid], values[valid]
+            n = np.bincount(codes, minlength=len(methods))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mu = np.bincount(codes, weights=values, minlength=len(methods)) / n
+            deviations = values - mu[codes]
+            count[:, j], mean[:, j] = n, mu
+            m2[:, j] = np.bincount(codes, weights=deviations * deviations, minlength=len(methods))
+            extremes = pd.Series(values).groupby(codes).agg(['min', 'max'])
+            minimum[extremes.index, j] = extremes['min']
+            maximum[extremes.index, j] = extremes['max']
+        sketches = None
+        if quantile_error is not None:
+            sketches = _sketch_grid(key_codes, len(methods), columns, quantile_error)
+        return cls(methods, subjects, count, mean, m2, minimum, maximum, dtype=dtype,
+                   sketches=sketches, quantile_error=quantile_error)
+
+    @classmethod
+    def from_histograms(cls, histograms, dtype=np.dtype(np.int64)):
+        counts = histograms.counts
+        scores = histograms.scores.astype(np.float64)
+        count = counts.sum(axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = counts @ scores / count
+        m2 = np.nansum(counts * (scores - mean[..., None]) ** 2, axis=-1)
+        nonzero = counts > 0
+        minimum = np.where(count > 0, scores[nonzero.argmax(axis=-1)], np.inf)
+        maximum = np.where(count > 0, scores[::-1][nonzero[..., ::-1].argmax(axis=-1)], -np.inf)
+        return cls(histograms.methods, histograms.subjects, count, mean, m2,
+                   minimum, maximum, histograms=histograms, dtype=dtype)
+
+    def _aligned(self, methods):
+        # Reindex onto ``methods`` (a superset of ours), filling absent groups as empty.
+        index = np.searchsorted(methods, self.methods)
+        shape = (len(methods), len(self.subjects))
+        arrays = []
+        for values, fill in ((self.count, 0), (self.mean, np.nan), (self.m2, 0.0),
+                             (self.minimum, np.inf), (self.maximum, -np.inf)):
+            aligned = np.full(shape, fill, dtype=values.dtype)
+            aligned[index] = values
+            arrays.append(aligned)
+        return arrays
+
+    def merge(self, other):
+        """Return the state of the union of the data behind ``self`` and ``other``."""
+        if self.subjects != other.subjects:
+            raise ValueError(f"Cannot merge states over different subjects: {self.subjects} vs {other.subjects}")
+        methods = np.union1d(self.methods, other.methods)
+        n_a, mean_a, m2_a, min_a, max_a = self._aligned(methods)
+        n_b, mean_b, m2_b, min_b, max_b = other._aligned(methods)
+        n = n_a + n_b
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.nan_to_num(mean_b) - np.nan_to_num(mean_a)
+            mean = np.where(n > 0, np.nan_to_num(mean_a) + delta * n_b / n, np.nan)
+            m2 = m2_a + m2_b + np.where(n > 0, delta * delta * n_a * n_b / n, 0.0)
+        histograms = sketches = None
+        if self.histograms is not None and other.histograms is not None:
+            histograms = _merge_histograms(self.histograms, other.histograms, methods)
+        elif self.quantile_error is not None and other.quantile_error is not None:
+            sketches = _merge_sketches(self._sketch_grid(), other._sketch_grid(),
+                                       self.methods, other.methods, methods)
+        quantile_error = None
+        if self.quantile_error is not None and other.quantile_error is not None:
+            quantile_error = max(self.quantile_error, other.quantile_error)
+        return GroupState(methods, self.subjects, n, mean, m2, np.minimum(min_a, min_b),
+                          np.maximum(max_a, max_b), histograms, np.result_type(self.dtype, other.dtype),
+                          sketches=sketches, quantile_error=quantile_error)
+
+    def _sketch_grid(self):
+        if self.sketches is None and self.histograms is not None:
+            # A shard with integer scores meeting one without: fall back to sketches.
+            return _sketches_from_histograms(self.histograms, self.quantile_error)
+        return self.sketches
+
+    @property
+    def approximate(self):
+        """Whether Median and IQR come from quantile sketches rather than exact data."""
+        return self.histograms is None and self.sketches is not None
+
+    @property
+    def has_quantiles(self):
+        return self.histograms is not None or self.sketches is not None
+
+    def stats(self):
+        """Dict of statistic arrays shaped (method, subject), as in ``STAT_COLUMNS``.
+
+        Median, Mode and IQR need histograms and are NaN without them, except
+        that sketches provide approximate Median and IQR.
+        """
+        histograms = self.histograms
+        return _summary_stats(self.count, self.mean, self.m2, self.minimum, self.maximum,
+                              None if histograms is None else histograms.counts,
+                              None if histograms is None else histograms.lo, self.sketches)
+
+    def describe(self, key='TeachingMethod', column_name='Subject'):
+        """The ``describe_wide`` table for the data behind this state.
+
+        When Median and IQR are sketch estimates, ``frame.attrs['approximate']``
+        lists those columns and ``frame.attrs['quantile_error']`` their rank error.
+        """
+        frame = _wide_frame(self.stats(), self.methods, self.subjects, self.dtype, key, column_name)
+        if self.approximate:
+            frame.attrs['approximate'] = list(APPROXIMATE_COLUMNS)
+            frame.attrs['quantile_error'] = self.quantile_error
+        return frame
+
+
+def _merge_histograms(a, b, methods):
+    lo = min(a.lo, b.lo)
+    n_bins = max(a.lo + a.counts.shape[-1], b.lo + b.counts.shape[-1]) - lo
+    counts = np.zeros((len(methods), len(a.subjects), n_bins), dtype=np.int64)
+    for part in (a, b):
+        offset = part.lo - lo
+        counts[np.searchsorted(methods, part.methods), :, offset:offset + part.counts.shape[-1]] += part.counts
+    return ScoreHistograms(counts, lo, methods, a.subjects)
+
+
+def _merge_sketches(a, b, methods_a, methods_b, methods):
+    grid = np.empty((len(methods), a.shape[1]), dtype=object)
+    for sketches, own in ((a, methods_a), (b, methods_b)):
+        for row, m in zip(sketches, np.searchsorted(methods, own)):
+            for j, sketch in enumerate(row):
+                grid[m, j] = sketch if grid[m, j] is None else grid[m, j].merge(sketch)
+    return grid
+
+
+def merge_states(states):
+    """Merge an iterable of ``GroupState`` shards into one state."""
+    return functools.reduce(GroupState.merge, states)
+
+
+_pools = {}  # worker count -> ProcessPoolExecutor, kept for the life of the server
+_pools_lock = threading.Lock()
+
+
+def _pool(workers):
+    # Spawning workers (and importing pandas in each) costs seconds, so pools are reused.
+    with _pools_lock:
+        if workers not in _pools:
+            # Spawned rather than forked workers: the Streamlit server is multi-threaded.
+            context = multiprocessing.get_context('spawn')
+            _pools[workers] = ProcessPoolExecutor(workers, mp_context=context)
+        return _pools[workers]
+
+
+def _discard_pool(workers, pool):
+    # A pool whose worker died stays broken; drop it so the next call starts a fresh one.
+    with _pools_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _call_attached(function, handles, *args):
+    # Runs in a pool worker: ``function`` sees the caller's arrays as read-only views
+    # of the shared memory, which is mapped for the duration of the call.
+    memories = [shared_memory.SharedMemory(name=name) for name, _, _ in handles]
+    arrays = []
+    try:
+        for memory, (_, shape, dtype) in zip(memories, handles):
+            array = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+            array.flags.writeable = False
+            arrays.append(array)
+        return function(arrays, *args)
+    finally:
+        del arrays
+        for memory in memories:
+            try:
+                memory.close()
+            except BufferError:
+                pass  # a traceback still holds a view; the mapping goes with it
+
+
+def pool_map(function, arrays, tasks, workers=None, done=None):
+    """``[function(arrays, *task) for task in tasks]``, run in a process pool.
+
+    ``arrays`` are copied once into shared memory that the pool's ``workers``
+    processes (``STATS_WORKERS``, else every core) attach to, so only the task
+    arguments and results cross process boundaries.  The pool is started on
+    first use and reused by later calls; if one of its workers dies, the pool is
+    discarded and the unfinished tasks run in this process.  A single worker
+    runs every task here.  ``done(i)`` is called as task ``i`` finishes.
+    """
+    workers = workers or STATS_WORKERS or os.cpu_count() or 1
+    results = [None] * len(tasks)
+    pending = list(range(len(tasks)))
+    if workers > 1 and len(tasks) > 1:
+        memories, handles = [], []
+        try:
+            for array in arrays:
+                memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                memories.append(memory)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=memory.buf)[...] = array
+                handles.append((memory.name, array.shape, array.dtype))
+            pool = _pool(workers)
+            try:
+                futures = {pool.submit(_call_attached, function, handles, *task): i
+                           for i, task in enumerate(tasks)}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    results[i] = future.result()
+                    pending.remove(i)
+                    if done:
+                        done(i)
+            except BrokenProcessPool:
+                _discard_pool(workers, pool)
+        finally:
+            for memory in memories:
+                memory.close()
+                memory.unlink()
+    for i in pending:
+        results[i] = function(arrays, *tasks[i])
+        if done:
+            done(i)
+    return results
+
+
+def _shard_state(arrays, start, stop, methods, subjects, dtype, quantile_error):
+    # astype copies out of the shared memory, so nothing outlives the mapping.
+    key_codes = arrays[0][start:stop].astype(np.int64)
+    columns = [column[start:stop].astype(dtype) for column in arrays[1:]]
+    return GroupState.from_codes(key_codes, methods, columns, subjects, dtype, quantile_error)
+
+
+def parallel_state(df, value_columns, key='TeachingMethod', suffix='Score', quantile_error=None,
+                   workers=None, min_rows=PARALLEL_MIN_ROWS):
+    """``GroupState.from_frame`` computed over row ranges with ``pool_map``.
+
+    The method codes and score columns are shared with a pool of ``workers``
+    processes (``STATS_WORKERS``, else every core), so only row bounds and the
+    small shard states cross process boundaries.  Frames under ``min_rows``
+    rows, or a single worker, run serially.
+    """
+    workers = workers or STATS_WORKERS or os.cpu_count() or 1
+    if workers <= 1 or len(df) < max(min_rows, 2):
+        return GroupState.from_frame(df, value_columns, key=key, suffix=suffix, quantile_error=quantile_error)
+
+    key_codes, methods, present = _method_codes(df, key)
+    subjects = [column.replace(suffix, '') for column in value_columns]
+    dtype = np.result_type(*[df[column].dtype for column in value_columns])
+    columns = [df[column].to_numpy() for column in value_columns]
+    if not present.all():
+        columns = [column[present] for column in columns]
+    bounds = np.linspace(0, len(key_codes), min(workers, len(key_codes)) + 1).astype(np.int64)
+    shards = pool_map(_shard_state, [key_codes] + columns,
+                      [(start, stop, methods, subjects, dtype, quantile_error)
+                       for start, stop in zip(bounds[:-1], bounds[1:])], workers)
+    # Merged in row order, so sketch compaction doesn't depend on scheduling.
+    return merge_states(shards)
+
+
+def _merge_along(sketches, axis):
+    merge = np.frompyfunc(lambda a, b: a.merge(b), 2, 1)
+    return merge.reduce(sketches, axis=axis)
+
+
+class StatsCube:
+    """Sufficient statistics over ``(method, *extra dims, subject)`` cells.
+
+    The cube is built once per data version and every table the dashboard shows
+    is a ``to_frame`` of it or of one of its roll-ups, so a rerun costs O(groups)
+    rather than a pass over the rows.  ``rollup(*dims)`` aggregates dimensions
+    away (e.g. all subjects per method) from the sufficient statistics alone;
+    with histograms the rolled-up quantiles stay exact.  Roll-ups are memoised.
+    """
+
+    def __init__(self, dims, labels, count, mean, m2, minimum, maximum, observed,
+                 histograms=None, lo=None, sketches=None, dtype=np.dtype(np.float64), quantile_error=None):
+        self.dims = list(dims)
+        self.labels = {dim: np.asarray(labels[dim]) for dim in self.dims}
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.minimum = minimum
+        self.maximum = maximum
+        self.observed = observed
+        self.histograms = histograms
+        self.lo = lo
+        self.sketches = sketches
+        self.dtype = np.dtype(dtype)
+        self.quantile_error = quantile_error
+        self._rollups = {}
+
+    @classmethod
+    def from_state(cls, state, key='TeachingMethod', column_name='Subject'):
+        histograms = state.histograms
+        return cls([key, column_name], {key: state.methods, column_name: state.subjects},
+                   state.count, state.mean, state.m2, state.minimum, state.maximum,
+                   np.ones(state.count.shape, dtype=bool),
+                   None if histograms is None else histograms.counts,
+                   None if histograms is None else histograms.lo,
+                   None if histograms is not None else state.sketches, state.dtype, state.quantile_error)
+
+    @classmethod
+    def from_frame(cls, df, value_columns, key='TeachingMethod', dims=(), column_name='Subject',
+                   suffix='Score', quantile_error=None):
+        """Cube of a wide frame over ``key``, any extra ``dims`` columns and the subjects."""
+        keys = [key, *dims]
+        codes = np.zeros(len(df), dtype=np.int64)
+        present = np.ones(len(df), dtype=bool)
+        labels = {}
+        for name in keys:
+            key_codes, uniques = factorize_labels(df[name])
+            present &= key_codes >= 0
+            codes = codes * len(uniques) + key_codes
+            labels[name] = np.asarray(uniques)
+        codes = codes[present]
+        key_shape = tuple(len(labels[name]) for name in keys)
+        n_cells = int(np.prod(key_shape))
+        columns = [df[column].to_numpy()[present] for column in value_columns]
+        subjects = [column.replace(suffix, '') for column in value_columns]
+        labels[column_name] = np.asarray(subjects)
+        dtype = np.result_type(*[df[column].dtype for column in value_columns])
+
+        state = GroupState.from_codes(codes, np.arange(n_cells), columns, subjects, dtype, quantile_error)
+        shape = key_shape + (len(subjects),)
+        observed = np.broadcast_to((np.bincount(codes, minlength=n_cells) > 0).reshape(key_shape + (1,)), shape)
+        histograms = state.histograms
+        return cls(keys + [column_name], labels,
+                   *(a.reshape(shape) for a in (state.count, state.mean, state.m2, state.minimum, state.maximum)),
+                   observed.copy(),
+                   None if histograms is None else histograms.counts.reshape(shape + (-1,)),
+                   None if histograms is None else histograms.lo,
+                   None if state.sketches is None else state.sketches.reshape(shape),
+                   dtype, quantile_error)
+
+    def rollup(self, *dims):
+        """Cube with ``dims`` aggregated away (e.g. ``rollup('Subject')`` = all subjects)."""
+        key = frozenset(dims)
+        if key not in self._rollups:
+            axes = tuple(self.dims.index(dim) for dim in dims)
+            kept = [dim for dim in self.dims if dim not in key]
+            count = self.count.sum(axis=axes)
+            weighted = np.where(self.count > 0, self.count * np.nan_to_num(self.mean), 0.0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = np.where(count > 0, weighted.sum(axis=axes) / count, np.nan)
+            spread = self.count * (np.nan_to_num(self.mean) - np.expand_dims(np.nan_to_num(mean), axes)) ** 2
+            m2 = self.m2.sum(axis=axes) + np.where(self.count > 0, spread, 0.0).sum(axis=axes)
+            sketches = self.sketches
+            if sketches is not None:
+                for axis in sorted(axes, reverse=True):
+                    sketches = _merge_along(sketches, axis)
+            self._rollups[key] = StatsCube(
+                kept, self.labels, count, mean, m2,
+                self.minimum.min(axis=axes), self.maximum.max(axis=axes), self.observed.any(axis=axes),
+                None if self.histograms is None else self.histograms.sum(axis=axes),
+                self.lo, sketches, self.dtype, self.quantile_error)
+        return self._rollups[key]
+
+    @property
+    def approximate(self):
+        return self.histograms is None and self.sketches is not None
+
+    def stats(self):
+        """Dict of statistic arrays shaped like the cube, as in ``STAT_COLUMNS``."""
+        return _summary_stats(self.count, self.mean, self.m2, self.minimum, self.maximum,
+                              self.histograms, self.lo, self.sketches)
+
+    def to_frame(self):
+        """One row per observed cell, ordered by the sorted labels of each dimension.
+
+        For a (method, subject) cube this is the ``describe_wide`` table.
+        """
+        orders = [np.argsort(self.labels[dim], kind='stable') for dim in self.dims]
+        grid = np.ix_(*orders)
+        observed = self.observed[grid].ravel()
+        index = np.meshgrid(*orders, indexing='ij')
+        frame = pd.DataFrame({dim: self.labels[dim][axis.ravel()[observed]]
+                              for dim, axis in zip(self.dims, index)})
+        stats = self.stats()
+        for column in STAT_COLUMNS:
+            frame[column] = np.asarray(stats[column])[grid].ravel()[observed]
+        for column in ('Mode', 'Range'):
+            frame[column] = _as_value_dtype(frame[column].to_numpy(), self.dtype)
+        if self.approximate:
+            frame.attrs['approximate'] = list(APPROXIMATE_COLUMNS)
+            frame.attrs['quantile_error'] = self.quantile_error
+        return frame
+
+
+class IncrementalStats:
+    """A ``GroupState`` kept current as new students are appended to the sheet.
+
+    Rows are assumed to be keyed by an increasing ``id_column``: ``refresh``
+    only aggregates rows above the stored watermark, so its cost is one hashing
+    pass plus work proportional to the new rows.  The rows already folded in are
+    checked against an order-independent checksum of their row hashes; if any
+    of them was added, removed or corrected, the state is rebuilt from scratch.
+    """
+
+    def __init__(self, value_columns, key='TeachingMethod', id_column='StudentID', suffix='Score',
+                 quantile_error=None, workers=None):
+        self.value_columns = list(value_columns)
+        self.quantile_error = quantile_error
+        self.workers = workers
+        self.key = key
+        self.id_column = id_column
+        self.suffix = suffix
+        self.state = None
+        self.watermark = None
+        self.rows = 0
+        self.checksum = 0
+        self.version = None
+        self._lock = threading.Lock()
+
+    def _row_hashes(self, df):
+        columns = [self.id_column, self.key] + self.value_columns
+        return pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+    @staticmethod
+    def _checksum(hashes):
+        return int(hashes.sum())  # uint64 sums wrap, so row order doesn't matter
+
+    def _state_of(self, df):
+        # Small deltas stay in-process; parallel_state falls back to serial for them.
+        return parallel_state(df, self.value_columns, key=self.key, suffix=self.suffix,
+                              quantile_error=self.quantile_error, workers=self.workers)
+
+    def rebuild(self, df, version=None):
+        with self._lock:
+            self.state = self._state_of(df)
+            self.watermark = df[self.id_column].max() if len(df) else None
+            self.rows = len(df)
+            self.checksum = self._checksum(self._row_hashes(df))
+            self.version = version
+            return self.state
+
+    def append(self, rows, version=None):
+        """Fold ``rows`` (e.g. a weekly delta file) into the stored state.
+
+        Rows whose id is not above the watermark are skipped as already counted.
+        """
+        with self._lock:
+            if self.state is None:
+                raise ValueError("Nothing to append to; call rebuild() or refresh() first")
+            if self.watermark is not None:
+                rows = rows[rows[self.id_column].to_numpy() > self.watermark]
+            if len(rows):
+                self.state = self.state.merge(self._state_of(rows))
+                self.watermark = rows[self.id_column].max() if self.watermark is None \
+                    else max(self.watermark, rows[self.id_column].max())
+                self.rows += len(rows)
+                self.checksum = (self.checksum + self._checksum(self._row_hashes(rows))) % 2 ** 64
+            self.version = version
+            return self.state
+
+    def refresh(self, df, version=None):
+        """Bring the state up to date with the full sheet ``df`` and return it."""
+        if self.state is not None and version is not None and version == self.version:
+            return self.state
+        if self.state is None or self.watermark is None:
+            return self.rebuild(df, version)
+        new = df[self.id_column].to_numpy() > self.watermark
+        if len(df) - np.count_nonzero(new) != self.rows \
+                or self._checksum(self._row_hashes(df)[~new]) != self.checksum:
+            return self.rebuild(df, version)
+        return self.append(df[new], version)
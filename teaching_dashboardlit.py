@@ -3,6 +3,14 @@ import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from data_loader import load_sheet, memory_footprint
+from figure_cache import discrete_colors, plotly_chart_json, template_free_json, with_template
+from inference import POST_HOC_TESTS, bootstrap_ci, manova, pairwise_comparisons, permutation_test
+from registry import registry
+from sql_engine import QUERY_ENGINE, SQLEngine
+from stats_engine import QUANTILE_ERROR, IncrementalStats, StatsCube, binned_scores, describe_wide
 
 # -------------------- CONFIG & STYLE --------------------
 st.set_page_config(layout="wide", page_title="Teaching Methods Dashboard")
@@ -35,25 +43,117 @@ teaching_method_colors = {
 }
 
 # -------------------- DATA LOADING & CLEANING --------------------
-df = pd.read_excel("teaching_data.xlsx", sheet_name='Sheet1')
-
-df_melted = df.melt(id_vars=['StudentID', 'TeachingMethod'],
-                    value_vars=['EnglishScore', 'MathScore', 'ChemistryScore', 'PhysicsScore', 'BiologyScore'],
-                    var_name='Subject', value_name='Score')
-df_melted['Subject'] = df_melted['Subject'].str.replace('Score', '')
-
-descriptive_stats = df_melted.groupby(['TeachingMethod', 'Subject']).agg(
-    Count=('Score', 'count'),
-    Mean=('Score', 'mean'),
-    Median=('Score', 'median'),
-    Mode=('Score', lambda x: x.mode().iloc[0] if not x.mode().empty else None),
-    StdDev=('Score', 'std'),
-    Variance=('Score', 'var'),
-    Range=('Score', lambda x: x.max() - x.min()),
-    IQR=('Score', lambda x: x.quantile(0.75) - x.quantile(0.25))
-).reset_index()
-
-descriptive_stats['CI'] = 1.96 * (descriptive_stats['StdDev'] / np.sqrt(descriptive_stats['Count']))
+df, data_version = load_sheet("teaching_data.xlsx", sheet_name='Sheet1',
+                              categories={'TeachingMethod': list(teaching_method_colors)})
+
+score_columns = ['EnglishScore', 'MathScore', 'ChemistryScore', 'PhysicsScore', 'BiologyScore']
+subjects = [column.replace('Score', '') for column in score_columns]
+
+
+@st.cache_resource
+def incremental_stats(path):
+    # One per workbook and server process: new students are folded into the stored aggregates.
+    return IncrementalStats(score_columns, key='TeachingMethod', id_column='StudentID',
+                            quantile_error=QUANTILE_ERROR)
+
+
+# Every session shares one copy of the sheet and of everything derived from it,
+# held in the registry for as long as some session is showing that data version.
+lease = st.session_state.get('data_lease')
+if lease is None or lease.version != data_version:
+    if lease is not None:
+        lease.release()
+    st.session_state['data_lease'] = registry.lease(data_version)
+registry.get(data_version, 'sheet', lambda: df)
+
+
+def summary_tables(version, frame):
+    if QUERY_ENGINE == "duckdb":
+        engine = SQLEngine(frame, score_columns, key='TeachingMethod', column_name='Subject')
+        try:
+            return engine.descriptive_stats(), engine.top_methods(), engine.overall_means()
+        finally:
+            engine.close()
+    state = incremental_stats("teaching_data.xlsx").refresh(frame, version)
+    # Every table below is read off the cube or one of its roll-ups.
+    cube = StatsCube.from_state(state, key='TeachingMethod', column_name='Subject')
+    if state.has_quantiles:
+        descriptive = cube.to_frame()
+    else:
+        # Exact quantiles of non-integer scores still need the full columns.
+        descriptive = describe_wide(frame, score_columns, key='TeachingMethod', column_name='Subject')
+    top = descriptive.loc[descriptive.groupby('Subject')['Mean'].idxmax()]
+    overall = cube.rollup('Subject').to_frame()[['TeachingMethod', 'Mean']].rename(columns={'Mean': 'Score'})
+    return descriptive, top, overall
+
+
+descriptive_stats, top_methods, overall_means = registry.get(
+    data_version, ('summary_tables', QUERY_ENGINE), lambda: summary_tables(data_version, df))
+
+
+def manova_results(version, frame):
+    # Keyed on the data version only, so widget changes never rerun the test.
+    return registry.get(version, 'manova', lambda: manova(frame, score_columns, key='TeachingMethod'))
+
+
+def stored_histograms(version, frame):
+    # The integer score histograms kept in the stored group state; None for other scores.
+    return registry.get(version, 'histograms',
+                        lambda: incremental_stats("teaching_data.xlsx").refresh(frame, version).histograms)
+
+
+def score_distributions(version, frame):
+    # Every distribution chart is read off these, so no chart ever carries per-student
+    # scores: the stored histograms, or bins and box statistics built once per data version.
+    histograms = stored_histograms(version, frame)
+    if histograms is not None:
+        return histograms
+    return registry.get(version, 'binned_scores', lambda: binned_scores(frame, score_columns, key='TeachingMethod'))
+
+
+def bootstrap_intervals(version, n_boot, seed, frame):
+    # Keyed on (data version, n_boot, seed), so restyling never resamples again.
+    name = ('bootstrap', n_boot, seed)
+    intervals = registry.peek(version, name)
+    if intervals is None:
+        # Integer scores are resampled from the stored histograms; others go to the worker pool.
+        progress_bar = st.progress(0.0, text="Resampling students…")
+        intervals = registry.get(version, name, lambda: bootstrap_ci(
+            frame, score_columns, key='TeachingMethod', column_name='Subject', n_boot=n_boot, seed=seed,
+            histograms=stored_histograms(version, frame),
+            progress=lambda done, total: progress_bar.progress(done / total, text=f"{done:,} / {total:,} resamples")
+        ))
+        progress_bar.empty()
+    return intervals
+
+
+def posthoc_results(version, test, summary):
+    return registry.get(version, ('posthoc', test), lambda: pairwise_comparisons(
+        summary, test=test, key='TeachingMethod', column_name='Subject'))
+
+
+def data_footprint(version, frame):
+    return registry.get(version, 'footprint', lambda: memory_footprint(frame))
+
+
+chart_payloads = {}  # chart id -> (figure bytes, bytes sent with the template) in this run
+
+
+def cached_chart(chart_id, build, template=None, per_template=False):
+    # Built and serialised once per (data version, chart id), without a template;
+    # reruns, template switches included, only splice the template into the stored JSON.
+    # px fills colours missing from color_discrete_map from the template while building,
+    # so px charts are built with ``build(template)`` and stored once per template.
+    template = template or template_choice
+    if per_template:
+        spec = registry.get(data_version, ('figure', chart_id, template),
+                            lambda: template_free_json(build(template)))
+    else:
+        spec = registry.get(data_version, ('figure', chart_id), lambda: template_free_json(build()))
+    payload = with_template(spec, template)
+    chart_payloads[chart_id] = (len(spec.encode()), len(payload.encode()))
+    plotly_chart_json(payload, use_container_width=True)
+
 
 # -------------------- UI HEADER --------------------
 st.markdown("# \U0001F393 *Teaching Method Effectiveness Dashboard*")
@@ -62,100 +162,311 @@ st.markdown("##### _Where educational theory meets statistical insight_")
 st.markdown("---")
 
 # -------------------- TABS --------------------
-tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs([
+# st.tabs runs every tab's body on each rerun; with a radio only the selected
+# view is computed, and what it computes stays in the registry for next time.
+views = [
     "\U0001F3AF CI Plots", "\U0001F3C6 Top Methods", "\U0001F4C8 Overall Comparison",
-    "\U0001F4DA Subject Breakdown", "\U0001F4CA MANOVA & Stats", "\U0001F4CB Raw Summary Table"
-])
+    "\U0001F4DA Subject Breakdown", "\U0001F4C9 Score Distributions", "\U0001F4CA MANOVA & Stats",
+    "\U0001F52C Post-hoc Comparisons", "\U0001F4CB Raw Summary Table"
+]
+view = st.radio("View:", options=views, horizontal=True, label_visibility="collapsed")
 
 # -------------------- TAB 1 --------------------
-with tab1:
+if view == views[0]:
     st.markdown("### \U0001F3AF Confidence Intervals: Mean Scores by Method")
     st.caption("Each bar shows the average student score for a given subject and teaching method, including a 95% confidence interval.")
-    for subject in df_melted['Subject'].unique():
-        sub_data = descriptive_stats[descriptive_stats['Subject'] == subject]
-        fig = go.Figure()
-        fig.add_trace(go.Bar(
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        ci_mode = st.radio("Error bars:", options=["Normal approximation", "Bootstrap percentile"],
+                           horizontal=True)
+    ci_source = ('normal',)
+    if ci_mode == "Bootstrap percentile":
+        with col2:
+            n_boot = st.select_slider("Bootstrap resamples:", options=[1000, 2000, 5000, 10000], value=2000)
+        ci_source = ('bootstrap', n_boot, 0)
+
+    single_figure = st.checkbox("Show all subjects in one figure", value=False)
+
+    def ci_table():
+        if ci_source[0] == 'bootstrap':
+            intervals = bootstrap_intervals(data_version, ci_source[1], ci_source[2], df)
+            return descriptive_stats.merge(intervals, on=['TeachingMethod', 'Subject'])
+        return descriptive_stats.assign(CILower=descriptive_stats['Mean'] - descriptive_stats['CI'],
+                                        CIUpper=descriptive_stats['Mean'] + descriptive_stats['CI'])
+
+    def ci_bar(sub_data, subject):
+        return go.Bar(
             x=sub_data['TeachingMethod'],
             y=sub_data['Mean'],
-            error_y=dict(type='data', array=sub_data['CI'], visible=True),
+            error_y=dict(type='data', array=sub_data['CIUpper'] - sub_data['Mean'],
+                         arrayminus=sub_data['Mean'] - sub_data['CILower'], visible=True),
             name=subject,
             marker_color=subject_colors.get(subject + 'Score', '#CCCCCC')
-        ))
+        )
+
+    def ci_figure(subject):
+        ci_stats = ci_table()
+        fig = go.Figure()
+        fig.add_trace(ci_bar(ci_stats[ci_stats['Subject'] == subject], subject))
         fig.update_layout(
             title=f"{subject} – Mean Score with 95% CI",
             xaxis_title="Teaching Method",
             yaxis_title="Mean Score",
-            template=template_choice,
             margin=dict(t=60, b=40, l=60, r=40)
         )
-        st.plotly_chart(fig, use_container_width=True)
+        return fig
+
+    def ci_facets():
+        # One figure, one layout and one payload for every subject, stacked on a shared method axis.
+        by_subject = ci_table().groupby('Subject', sort=False)
+        fig = make_subplots(rows=len(subjects), cols=1, shared_xaxes=True, vertical_spacing=0.05,
+                            subplot_titles=[f"{subject} – Mean Score with 95% CI" for subject in subjects])
+        for row, subject in enumerate(subjects, start=1):
+            fig.add_trace(ci_bar(by_subject.get_group(subject), subject), row=row, col=1)
+        fig.update_yaxes(title_text="Mean Score")
+        fig.update_xaxes(title_text="Teaching Method", row=len(subjects), col=1)
+        fig.update_layout(height=250 * len(subjects), showlegend=False, margin=dict(t=60, b=40, l=60, r=40))
+        return fig
+
+    if single_figure:
+        cached_chart(('ci_facets', ci_source), ci_facets)
+    else:
+        for subject in subjects:
+            cached_chart(('ci', subject, ci_source), lambda: ci_figure(subject))
 
 # -------------------- TAB 2 --------------------
-with tab2:
+if view == views[1]:
     st.markdown("### \U0001F3C6 Top Performing Teaching Methods")
     st.caption("For each subject, the teaching method that yielded the highest average score is shown.")
-    top_methods = descriptive_stats.loc[descriptive_stats.groupby('Subject')['Mean'].idxmax()]
-    fig = px.bar(top_methods, x='Subject', y='Mean', color='TeachingMethod',
-                 title='Best Method by Subject', template=template_choice,
-                 color_discrete_map=teaching_method_colors)
-    st.plotly_chart(fig, use_container_width=True)
+    cached_chart('top_methods', lambda template: px.bar(
+        top_methods, x='Subject', y='Mean', color='TeachingMethod',
+        title='Best Method by Subject', template=template,
+        color_discrete_map=teaching_method_colors), per_template=True)
 
 # -------------------- TAB 3 --------------------
-with tab3:
+if view == views[2]:
     st.markdown("### \U0001F4C8 Overall Teaching Method Comparison")
     st.caption("Average of all subject scores per method.")
-    overall_means = df_melted.groupby('TeachingMethod')['Score'].mean().reset_index()
-    fig = px.bar(overall_means, x='TeachingMethod', y='Score',
-                 title='Average Score by Teaching Method',
-                 template=template_choice, color='TeachingMethod',
-                 color_discrete_map=teaching_method_colors)
-    st.plotly_chart(fig, use_container_width=True)
+    cached_chart('overall_means', lambda template: px.bar(
+        overall_means, x='TeachingMethod', y='Score',
+        title='Average Score by Teaching Method', template=template, color='TeachingMethod',
+        color_discrete_map=teaching_method_colors), per_template=True)
 
 # -------------------- TAB 4 --------------------
-with tab4:
+if view == views[3]:
     st.markdown("### \U0001F4DA Score Breakdown by Subject and Method")
     st.caption("Grouped bar chart showing how each teaching method performed across subjects.")
-    fig = px.bar(descriptive_stats, x='Subject', y='Mean', color='TeachingMethod',
-                 barmode='group', title='Method Comparison per Subject',
-                 template=template_choice, color_discrete_map=teaching_method_colors)
-    st.plotly_chart(fig, use_container_width=True)
+    cached_chart('subject_breakdown', lambda template: px.bar(
+        descriptive_stats, x='Subject', y='Mean', color='TeachingMethod',
+        barmode='group', title='Method Comparison per Subject', template=template,
+        color_discrete_map=teaching_method_colors), per_template=True)
 
 # -------------------- TAB 5 --------------------
-with tab5:
-    st.markdown("### \U0001F4CA MANOVA Results & Statistical Summary")
+if view == views[4]:
+    st.markdown("### \U0001F4C9 Score Distributions by Method")
+    st.caption("Histograms and box plots of every student's score, binned on the server so each chart carries "
+               "a few hundred numbers however many students there are.")
+    distributions = score_distributions(data_version, df)
     col1, col2 = st.columns([1, 1])
     with col1:
-        st.success("The MANOVA test reveals a statistically significant effect of teaching method on student scores.")
-        st.markdown("**P-value = 2.2e-16**")
+        distribution_subject = st.selectbox("Subject:", options=subjects)
     with col2:
+        as_share = st.checkbox("Show share of each method's students", value=True)
+    subject_index = distributions.subjects.index(distribution_subject)
+
+    def histogram_figure(template):
+        colors = discrete_colors(distributions.methods, teaching_method_colors, template)
+        counts = distributions.counts[:, subject_index, :]
+        centres, width = distributions.bins(subject_index)
+        observed = np.flatnonzero(counts.sum(axis=0))
+        bins = slice(observed[0], observed[-1] + 1) if len(observed) else slice(0, 0)
+        fig = go.Figure()
+        for m, method in enumerate(distributions.methods):
+            heights = counts[m, bins]
+            if as_share:
+                heights = 100 * heights / max(counts[m].sum(), 1)
+            fig.add_trace(go.Bar(x=centres[bins], y=heights, width=width, name=method, opacity=0.6,
+                                 marker_color=colors[m]))
+        fig.update_layout(
+            title=f"{distribution_subject} – Score Distribution by Method",
+            xaxis_title="Score", yaxis_title="Share of students (%)" if as_share else "Students",
+            barmode='overlay', bargap=0, margin=dict(t=60, b=40, l=60, r=40)
+        )
+        return fig
+
+    def box_figure(template):
+        # Quartiles and whisker fences come precomputed, so plotly draws each box from six numbers.
+        colors = discrete_colors(distributions.methods, teaching_method_colors, template)
+        box = distributions.box_stats()
+        fig = go.Figure()
+        for m, method in enumerate(distributions.methods):
+            if not distributions.counts[m, subject_index].any():
+                continue
+            fig.add_trace(go.Box(
+                x=[method], name=method,
+                q1=[box['q1'][m, subject_index]], median=[box['median'][m, subject_index]],
+                q3=[box['q3'][m, subject_index]], mean=[box['mean'][m, subject_index]],
+                lowerfence=[box['lowerfence'][m, subject_index]],
+                upperfence=[box['upperfence'][m, subject_index]],
+                marker_color=colors[m]
+            ))
+        fig.update_layout(
+            title=f"{distribution_subject} – Score Spread by Method",
+            xaxis_title="Teaching Method", yaxis_title="Score", showlegend=False,
+            margin=dict(t=60, b=40, l=60, r=40)
+        )
+        return fig
+
+    # Methods missing from the colour map take the template's colours, as in the px tabs.
+    cached_chart(('distribution_histogram', distribution_subject, as_share), histogram_figure, per_template=True)
+    cached_chart(('distribution_box', distribution_subject), box_figure, per_template=True)
+
+# -------------------- TAB 6 --------------------
+if view == views[5]:
+    st.markdown("### \U0001F4CA MANOVA Results & Statistical Summary")
+    manova_table = manova_results(data_version, df)
+    p_value = manova_table.loc["Pillai's trace", 'Pr > F']
+    significant = p_value < 0.05
+    p_label = "p < 2.2e-16" if p_value < np.finfo(float).eps else f"p = {p_value:.2e}"
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        if significant:
+            st.success("The MANOVA test reveals a statistically significant effect of teaching method on student scores.")
+        else:
+            st.info("The MANOVA test finds no statistically significant effect of teaching method on student scores.")
+        st.markdown(f"**Pillai's trace {p_label}**")
+
+    def p_value_figure():
         pval_fig = go.Figure()
         pval_fig.add_shape(type='rect', x0=0.05, x1=1, y0=0, y1=1, fillcolor='lightgrey', line=dict(width=0))
         pval_fig.add_shape(type='rect', x0=0, x1=0.05, y0=0, y1=1, fillcolor='lightgreen', line=dict(width=0))
         pval_fig.add_trace(go.Scatter(
-            x=[2.2e-16], y=[0.5], mode='markers+text',
+            x=[p_value], y=[0.5], mode='markers+text',
             marker=dict(size=12, color='red'),
-            text=["p = 2.2e-16"], textposition="bottom center"
+            text=[p_label], textposition="bottom center"
         ))
         pval_fig.update_layout(
             xaxis_title="P-value", yaxis=dict(visible=False),
-            xaxis=dict(range=[0, 0.1]), height=200,
-            template="plotly_white", showlegend=False
+            xaxis=dict(range=[0, 0.1 if p_value <= 0.1 else 1]), height=200, showlegend=False
         )
-        st.plotly_chart(pval_fig, use_container_width=True)
+        return pval_fig
+
+    with col2:
+        cached_chart('manova_p_value', p_value_figure, template="plotly_white")
+    st.dataframe(manova_table.style.format({'Value': '{:.4f}', 'Num DF': '{:.0f}', 'Den DF': '{:.1f}',
+                                            'F Value': '{:.2f}', 'Pr > F': '{:.2e}'}),
+                 use_container_width=True)
+    with st.expander("\U0001F500 Permutation test (distribution-free p-value)"):
+        st.caption("Shuffles the teaching-method labels and recomputes Pillai's trace for each shuffle.")
+        n_permutations = st.select_slider("Permutations:", options=[1000, 2000, 5000, 10000], value=1000)
+        permutation_name = ('permutation', n_permutations, 0)
+        permutation = registry.peek(data_version, permutation_name)
+        if permutation is None and st.button("Run permutation test"):
+            progress_bar = st.progress(0.0, text="Running permutations…")
+            permutation = registry.get(data_version, permutation_name, lambda: permutation_test(
+                df, score_columns, key='TeachingMethod', n_permutations=n_permutations, seed=0,
+                progress=lambda done, total: progress_bar.progress(done / total, text=f"{done:,} / {total:,} permutations")
+            ))
+            progress_bar.empty()
+        if permutation is not None:
+            st.markdown(f"**Permutation p-value = {permutation.p_value:.2e}** "
+                        f"({permutation.n_permutations:,} permutations, seed {permutation.seed})")
+
+            def null_figure():
+                null_fig = go.Figure(go.Histogram(x=permutation.null_distribution, nbinsx=50,
+                                                  marker_color='lightgrey', name="Shuffled labels"))
+                null_fig.add_vline(x=permutation.statistic, line_color='red', annotation_text="Observed")
+                null_fig.update_layout(xaxis_title="Pillai's trace", yaxis_title="Permutations", height=250,
+                                       showlegend=False, margin=dict(t=30, b=40, l=60, r=40))
+                return null_fig
+
+            cached_chart(permutation_name, null_figure)
     st.markdown("---")
-    st.markdown("""
-    **\U0001F3DB️ Interpretation:**
-    - The extremely low p-value indicates **strong statistical evidence** that teaching methods influence student outcomes.
-    - **Different methods yield measurably different performance**.
+    if significant:
+        st.markdown("""
+        **\U0001F3DB️ Interpretation:**
+        - The low p-value indicates **strong statistical evidence** that teaching methods influence student outcomes.
+        - **Different methods yield measurably different performance**.
 
-    **MANOVA Framework**
-    - **H₀**: Teaching styles have no effect on performance.
-    - **H₁**: At least one style significantly differs.
-    - **Conclusion**: Reject H₀. Teaching method matters.
-    """)
+        **MANOVA Framework**
+        - **H₀**: Teaching styles have no effect on performance.
+        - **H₁**: At least one style significantly differs.
+        - **Conclusion**: Reject H₀. Teaching method matters.
+        """)
+    else:
+        st.markdown("""
+        **\U0001F3DB️ Interpretation:**
+        - The p-value is above 0.05, so the data give **no strong evidence** that teaching methods influence student outcomes.
 
-# -------------------- TAB 6 --------------------
-with tab6:
+        **MANOVA Framework**
+        - **H₀**: Teaching styles have no effect on performance.
+        - **H₁**: At least one style significantly differs.
+        - **Conclusion**: Fail to reject H₀.
+        """)
+
+# -------------------- TAB 7 --------------------
+if view == views[6]:
+    st.markdown("### \U0001F52C Post-hoc Comparisons Between Methods")
+    st.caption("Every pair of teaching methods compared within a subject, with p-values adjusted for multiple comparisons.")
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        posthoc_test = st.radio("Test:", options=list(POST_HOC_TESTS), format_func=POST_HOC_TESTS.get,
+                                horizontal=True)
+    with col2:
+        posthoc_subject = st.selectbox("Subject:", options=subjects)
+    pairs = posthoc_results(data_version, posthoc_test, descriptive_stats)
+    subject_pairs = pairs[pairs['Subject'] == posthoc_subject]
+
+    def heatmap_figure():
+        methods = sorted(set(subject_pairs['MethodA']) | set(subject_pairs['MethodB']))
+        position = {method: i for i, method in enumerate(methods)}
+        p_matrix = np.full((len(methods), len(methods)), np.nan)
+        difference_matrix = np.full_like(p_matrix, np.nan)
+        rows = subject_pairs['MethodA'].map(position).to_numpy()
+        cols = subject_pairs['MethodB'].map(position).to_numpy()
+        p_matrix[rows, cols] = p_matrix[cols, rows] = subject_pairs['p-adj']
+        difference_matrix[rows, cols] = subject_pairs['MeanDiff']
+        difference_matrix[cols, rows] = -subject_pairs['MeanDiff']
+        heatmap_fig = go.Figure(go.Heatmap(
+            z=p_matrix, x=methods, y=methods, zmin=0, zmax=1, colorscale='RdYlGn_r',
+            text=np.where(np.isnan(difference_matrix), "", np.char.mod('%+.2f', np.nan_to_num(difference_matrix))),
+            texttemplate="%{text}", colorbar=dict(title="Adjusted p"),
+            hovertemplate="%{y} − %{x}: %{text}<br>adjusted p = %{z:.3g}<extra></extra>"
+        ))
+        heatmap_fig.update_layout(
+            title=f"{posthoc_subject} – {POST_HOC_TESTS[posthoc_test]} (cell text: row − column mean difference)",
+            height=550, yaxis=dict(autorange='reversed'),
+            margin=dict(t=60, b=40, l=60, r=40)
+        )
+        return heatmap_fig
+
+    cached_chart(('posthoc', posthoc_test, posthoc_subject), heatmap_figure)
+    st.dataframe(subject_pairs.drop(columns='Subject').style.format(
+        {'MeanDiff': '{:+.2f}', 'q': '{:.2f}', 'DF': '{:.1f}', 'p-adj': '{:.3g}'}), use_container_width=True,
+        hide_index=True)
+
+# -------------------- TAB 8 --------------------
+if view == views[7]:
     st.markdown("### \U0001F4CB Full Descriptive Statistics Table")
     st.caption("Includes mean, median, standard deviation, confidence interval, and more.")
-    st.dataframe(descriptive_stats.round(2), use_container_width=True)
+    approximate = descriptive_stats.attrs.get('approximate', [])
+    summary_table = descriptive_stats.round(2).rename(columns={c: f"{c} ≈" for c in approximate})
+    st.dataframe(summary_table, use_container_width=True)
+    if approximate:
+        st.caption(f"≈ Estimated from quantile sketches (within about "
+                   f"{descriptive_stats.attrs['quantile_error']:.1%} rank error); Mode is not estimated.")
+    used_bytes, default_bytes = data_footprint(data_version, df)
+    st.caption(f"Score sheet: {len(df):,} students in {used_bytes / 1024:,.1f} KiB, "
+               f"{1 - used_bytes / default_bytes:.0%} less than with default dtypes.")
+
+# -------------------- PAYLOADS --------------------
+if chart_payloads:
+    with st.sidebar.expander("\U0001F4E6 Chart payloads"):
+        payload_table = pd.DataFrame(
+            [(" / ".join(map(str, chart_id if isinstance(chart_id, tuple) else (chart_id,))), figure_bytes / 1024,
+              sent_bytes / 1024) for chart_id, (figure_bytes, sent_bytes) in chart_payloads.items()],
+            columns=['Chart', 'Figure KiB', 'Sent KiB'])
+        st.dataframe(payload_table.style.format({'Figure KiB': '{:.1f}', 'Sent KiB': '{:.1f}'}),
+                     use_container_width=True, hide_index=True)
+        st.caption(f"{payload_table['Sent KiB'].sum():,.1f} KiB sent for this view; "
+                   f"the rest of each payload is the chart template.")
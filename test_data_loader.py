@@ -0,0 +1,123 @@
+"""Checks of the workbook cache and its typed sidecars."""
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+import data_loader
+from data_loader import load_sheet, memory_footprint, sidecar_path
+
+
+def write_workbook(path, scores):
+    pd.DataFrame({
+        'StudentID': np.arange(1, len(scores) + 1),
+        'TeachingMethod': ['Facilitator', 'Group Learning'] * (len(scores) // 2),
+        'MathScore': scores,
+    }).to_excel(path, sheet_name='Sheet1', index=False)
+
+
+@pytest.fixture
+def workbook(tmp_path, monkeypatch):
+    # Every test starts without parsed frames, as a fresh server process would.
+    monkeypatch.setattr(data_loader, '_frames', {})
+    monkeypatch.setattr(data_loader, '_versions', {})
+    path = tmp_path / 'scores.xlsx'
+    write_workbook(path, [70, 80, 90, 100])
+    return str(path)
+
+
+def forget_frames():
+    data_loader._frames.clear()
+    data_loader._versions.clear()
+
+
+def refuse_excel(monkeypatch):
+    def read_excel(*args, **kwargs):
+        raise AssertionError("the workbook was parsed although a fresh sidecar exists")
+    monkeypatch.setattr(pd, 'read_excel', read_excel)
+
+
+def test_parquet_sidecar_is_typed_and_read_instead_of_the_workbook(workbook, monkeypatch):
+    df, version = load_sheet(workbook, backend='parquet')
+    schema = pq.read_schema(sidecar_path(workbook, backend='parquet'))
+    assert str(schema.field('MathScore').type) == 'uint8'
+    assert str(schema.field('StudentID').type) == 'int32'
+    assert df['TeachingMethod'].dtype == object
+
+    forget_frames()
+    refuse_excel(monkeypatch)
+    again, same_version = load_sheet(workbook, backend='parquet', columns=['MathScore'])
+    assert same_version == version
+    assert list(again.columns) == ['MathScore']
+    assert again['MathScore'].tolist() == [70, 80, 90, 100]
+
+
+def test_arrow_sidecar_is_served_as_read_only_views_of_the_mapped_file(workbook, monkeypatch):
+    # Served from the map both right after writing it and on a later, parse-free load.
+    for attempt in range(2):
+        df, _ = load_sheet(workbook, backend='arrow')
+        values = df['MathScore'].to_numpy()
+        assert values.dtype == np.uint8
+        assert not values.flags.owndata and not values.flags.writeable
+        forget_frames()
+        refuse_excel(monkeypatch)
+
+
+@pytest.mark.parametrize('backend', ['parquet', 'arrow'])
+def test_sidecar_is_rebuilt_when_the_workbook_changes(workbook, backend):
+    _, first = load_sheet(workbook, backend=backend)
+    write_workbook(workbook, [10, 20, 30, 40])
+    df, second = load_sheet(workbook, backend=backend)
+    assert second != first
+    assert df['MathScore'].tolist() == [10, 20, 30, 40]
+
+    forget_frames()
+    df, _ = load_sheet(workbook, backend=backend)
+    assert df['MathScore'].tolist() == [10, 20, 30, 40]
+
+
+def test_sidecar_from_another_workbook_version_is_not_trusted(workbook, tmp_path):
+    load_sheet(workbook, backend='parquet')
+    stale = sidecar_path(workbook, backend='parquet')
+    other = str(tmp_path / 'other.xlsx')
+    write_workbook(other, [1, 2, 3, 4])
+    load_sheet(other, backend='parquet')
+    # A newer sidecar whose recorded hash belongs to different content.
+    os.replace(sidecar_path(other, backend='parquet'), stale)
+
+    forget_frames()
+    df, _ = load_sheet(workbook, backend='parquet')
+    assert df['MathScore'].tolist() == [70, 80, 90, 100]
+
+
+@pytest.mark.parametrize('order, expected', [
+    (['Group Learning', 'Facilitator'], ['Group Learning', 'Facilitator']),
+    (['Lecture-based Instruction', 'Group Learning'], ['Lecture-based Instruction', 'Group Learning', 'Facilitator']),
+])
+@pytest.mark.parametrize('backend', ['parquet', 'arrow'])
+def test_categories_come_back_in_the_callers_order(workbook, backend, order, expected):
+    # Once from the freshly parsed workbook, once from the sidecar.
+    for attempt in range(2):
+        df, _ = load_sheet(workbook, backend=backend, categories={'TeachingMethod': order})
+        assert df['TeachingMethod'].cat.categories.tolist() == expected
+        assert df['TeachingMethod'].tolist() == ['Facilitator', 'Group Learning'] * 2
+        forget_frames()
+
+
+def test_scores_with_gaps_load_as_float(workbook):
+    write_workbook(workbook, [70, None, 90, 100])
+    df, _ = load_sheet(workbook, backend='parquet')
+    assert str(pq.read_schema(sidecar_path(workbook, backend='parquet')).field('MathScore').type) == 'uint8'
+    assert df['MathScore'].dtype == np.float64
+    assert df['MathScore'].isna().tolist() == [False, True, False, False]
+
+
+def test_memory_footprint_compares_with_read_excel_dtypes(workbook):
+    df, _ = load_sheet(workbook, backend='parquet', categories={'TeachingMethod': []})
+    used, default = memory_footprint(df)
+    parsed = pd.read_excel(workbook)
+    assert used == df.memory_usage(index=False, deep=True).sum()
+    assert default == parsed.memory_usage(index=False, deep=True).sum()
+    assert used < default
@@ -0,0 +1,83 @@
+"""Checks of the serialised figures: template splicing and array rounding."""
+import json
+
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io
+import pytest
+
+from figure_cache import discrete_colors, figure_json, round_significant, template_free_json, with_template
+
+TEMPLATES = ['plotly', 'plotly_dark', 'ggplot2', 'simple_white']
+
+
+def bar_chart(template=None):
+    figure = go.Figure(go.Bar(x=['Facilitator', 'Group Learning'], y=[71, 84]))
+    figure.update_layout(title='Mean score', template=template)
+    return figure
+
+
+@pytest.mark.parametrize('template', TEMPLATES)
+def test_spliced_template_matches_a_figure_built_with_it(template):
+    spliced = with_template(template_free_json(bar_chart()), template)
+    assert json.loads(spliced) == json.loads(figure_json(bar_chart(template)))
+
+
+def test_template_splices_into_an_empty_layout():
+    spliced = json.loads(with_template(template_free_json(go.Figure(go.Scatter(y=[1, 2]))), 'plotly_white'))
+    assert list(spliced['layout']) == ['template']
+    assert spliced == json.loads(figure_json(go.Figure(go.Scatter(y=[1, 2]), layout={'template': 'plotly_white'})))
+
+
+@pytest.mark.parametrize('template', TEMPLATES)
+def test_px_charts_built_per_template_keep_their_colours(template):
+    # Labels missing from the colour map take the template's colorway when the chart is built.
+    df = {'Method': ['Facilitator', 'Group Learning', 'Lecture'], 'Score': [71, 84, 66]}
+
+    def build(template):
+        return px.bar(df, x='Method', y='Score', color='Method', template=template,
+                      color_discrete_map={'Facilitator': '#1f77b4'})
+    spliced = json.loads(with_template(template_free_json(build(template)), template))
+    assert spliced == json.loads(figure_json(build(template)))
+    colorway = plotly.io.templates[template].layout.colorway
+    assert [trace['marker']['color'] for trace in spliced['data']] == ['#1f77b4', *colorway[1:3]]
+
+
+def test_round_significant_keeps_five_digits():
+    rounded = round_significant([3.14159265, -0.000123456789, 98765.4321, 1.5e-300, 0.0, np.nan, np.inf])
+    np.testing.assert_array_equal(rounded, [3.1416, -0.00012346, 98765.0, 1.5e-300, 0.0, np.nan, np.inf])
+    assert [repr(value) for value in rounded[:2]] == ['3.1416', '-0.00012346']
+
+
+def test_round_significant_writes_whole_numbers_as_integers():
+    rounded = round_significant([70.0, 84.000001, -3.0, 1234567.0])
+    assert rounded.dtype == np.int64
+    np.testing.assert_array_equal(rounded, [70, 84, -3, 1234600])
+
+
+def test_round_significant_leaves_subnormals_alone():
+    # An underflowed p-value needs a scale of 10 ** 327, beyond float range.
+    values = np.array([5e-324, 2.5e-310, 1e-5])
+    rounded = round_significant(values)
+    np.testing.assert_array_equal(rounded, values)
+
+
+def test_template_free_json_rounds_numeric_arrays_only():
+    figure = go.Figure(go.Scatter(x=['a', 'b'], y=[1 / 3, 2 / 3], customdata=[[1.23456789, 'x']]))
+    trace = json.loads(template_free_json(figure))['data'][0]
+    assert trace['y'] == [0.33333, 0.66667]
+    assert trace['x'] == ['a', 'b']
+    assert trace['customdata'] == [[1.23456789, 'x']]
+
+
+@pytest.mark.parametrize('template', TEMPLATES + ['none'])
+def test_discrete_colors_match_px(template):
+    # 'none' has no colorway, so px falls back to D3.
+    labels = ['Facilitator', 'Group Learning', 'Inquiry-based Learning', 'Lecture-based Instruction']
+    color_map = {'Facilitator': '#6BA6A8', 'Group Learning': '#B6C867', 'Individual Learning': '#D9D4CF'}
+    figure = px.bar({'Method': labels, 'Score': [71, 84, 66, 75]}, x='Method', y='Score', color='Method',
+                    template=template, color_discrete_map=color_map)
+    colors = discrete_colors(labels, color_map, template)
+    assert colors == [trace.marker.color for trace in figure.data]
+    assert len(set(colors)) == len(labels)
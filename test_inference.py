@@ -0,0 +1,152 @@
+"""Checks of the hypothesis tests against statsmodels and scipy."""
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+import inference
+
+from conftest import METHODS, VALUE_COLUMNS, scores
+from inference import (MANOVA_COLUMNS, SSCPAccumulator, bootstrap_ci, group_moments, manova, manova_chunks,
+                       pairwise_comparisons, permutation_test)
+from stats_engine import describe_wide
+
+
+def statsmodels_manova(df):
+    module = pytest.importorskip('statsmodels.multivariate.manova')
+    formula = ' + '.join(VALUE_COLUMNS) + ' ~ TeachingMethod'
+    return module.MANOVA.from_formula(formula, data=df).mv_test().results['TeachingMethod']['stat']
+
+
+def assert_same_manova(table, reference):
+    for column in MANOVA_COLUMNS:
+        np.testing.assert_allclose(table[column].to_numpy(dtype=np.float64),
+                                   reference.loc[table.index, column].to_numpy(dtype=np.float64), rtol=1e-6)
+
+
+@pytest.mark.parametrize('kind', ['integer', 'fractional'])
+def test_manova_matches_statsmodels(kind):
+    df = scores(kind).dropna()
+    assert_same_manova(manova(df, VALUE_COLUMNS), statsmodels_manova(df))
+
+
+def test_manova_uses_complete_cases():
+    df = scores('missing')
+    assert_same_manova(manova(df, VALUE_COLUMNS), statsmodels_manova(df.dropna()))
+
+
+def test_group_moments_match_per_group_covariances():
+    rng = np.random.default_rng(0)
+    codes = rng.integers(0, 4, 500)
+    codes[codes == 2] = 3  # an empty group
+    block = rng.normal(size=(500, 3))
+    original = block.copy()
+    counts, means, sscp = group_moments(codes, block, 4)
+    np.testing.assert_array_equal(block, original)
+    assert counts[2] == 0 and np.isnan(means[2]).all() and not sscp[2].any()
+    for group in (0, 1, 3):
+        rows = block[codes == group]
+        np.testing.assert_allclose(means[group], rows.mean(axis=0), rtol=1e-12)
+        np.testing.assert_allclose(sscp[group], np.cov(rows, rowvar=False) * (len(rows) - 1), rtol=1e-9)
+
+
+def test_manova_over_chunks_matches_the_whole_sheet():
+    df = scores('missing', n=2000)
+    chunks = [df.iloc[rows] for rows in np.array_split(np.arange(len(df)), 7)]
+    whole = manova(df, VALUE_COLUMNS)
+    np.testing.assert_allclose(manova_chunks(chunks, VALUE_COLUMNS).to_numpy(dtype=np.float64),
+                               whole.to_numpy(dtype=np.float64), rtol=1e-9)
+    # Accumulators of separate chunks merge in any order.
+    parts = [SSCPAccumulator(VALUE_COLUMNS).update(chunk) for chunk in chunks]
+    merged = parts[3].merge(parts[0]).merge(parts[6]).merge(parts[1].merge(parts[5]).merge(parts[2].merge(parts[4])))
+    np.testing.assert_allclose(merged.manova().to_numpy(dtype=np.float64),
+                               whole.to_numpy(dtype=np.float64), rtol=1e-9)
+
+
+def test_permutation_test_observes_pillais_trace():
+    df = scores('missing')
+    progress = []
+    result = permutation_test(df, VALUE_COLUMNS, n_permutations=250, workers=1,
+                              progress=lambda done, total: progress.append((done, total)))
+    assert result.statistic == pytest.approx(manova(df, VALUE_COLUMNS).loc["Pillai's trace", 'Value'], rel=1e-9)
+    assert len(result.null_distribution) == 250
+    assert result.p_value == pytest.approx(1 / 251)  # methods differ by design
+    assert progress[-1] == (250, 250)
+
+
+def test_permutation_test_does_not_depend_on_the_worker_count(monkeypatch):
+    monkeypatch.setattr(inference, 'PARALLEL_MIN_CELLS', 0)
+    df = scores('fractional')
+    df['TeachingMethod'] = np.random.default_rng(1).permutation(df['TeachingMethod'].to_numpy())
+    serial = permutation_test(df, VALUE_COLUMNS, n_permutations=450, seed=3, workers=1)
+    pooled = permutation_test(df, VALUE_COLUMNS, n_permutations=450, seed=3, workers=2)
+    np.testing.assert_array_equal(serial.null_distribution, pooled.null_distribution)
+    assert serial.p_value == pooled.p_value > 0.01
+
+
+def subject_groups(df):
+    # Scores per subject, one array per method in sorted order.
+    methods = sorted(METHODS)
+    for column in VALUE_COLUMNS:
+        yield column.replace('Score', ''), [df.loc[df['TeachingMethod'] == m, column].dropna() for m in methods]
+
+
+def test_tukey_matches_scipy():
+    df = scores('fractional')
+    pairs = pairwise_comparisons(describe_wide(df, VALUE_COLUMNS), test='tukey')
+    methods = sorted(METHODS)
+    for subject, groups in subject_groups(df):
+        reference = stats.tukey_hsd(*groups)
+        rows = pairs[pairs['Subject'] == subject]
+        a = rows['MethodA'].map(methods.index).to_numpy()
+        b = rows['MethodB'].map(methods.index).to_numpy()
+        np.testing.assert_allclose(rows['MeanDiff'], reference.statistic[a, b], rtol=1e-9)
+        np.testing.assert_allclose(rows['p-adj'], reference.pvalue[a, b], rtol=1e-4, atol=1e-8)
+
+
+def test_games_howell_matches_the_pairwise_formula():
+    df = scores('missing')
+    pairs = pairwise_comparisons(describe_wide(df, VALUE_COLUMNS), test='games-howell')
+    for subject, groups in subject_groups(df):
+        rows = pairs[pairs['Subject'] == subject].reset_index(drop=True)
+        expected = []
+        for i, j in zip(*np.triu_indices(len(groups), k=1)):
+            x, y = groups[i], groups[j]
+            share_x, share_y = x.var() / len(x), y.var() / len(y)
+            dof = (share_x + share_y) ** 2 / (share_x ** 2 / (len(x) - 1) + share_y ** 2 / (len(y) - 1))
+            q = abs(x.mean() - y.mean()) / np.sqrt((share_x + share_y) / 2)
+            expected.append((x.mean() - y.mean(), q, dof, stats.studentized_range.sf(q, len(groups), dof)))
+        expected = np.array(expected)
+        np.testing.assert_allclose(rows[['MeanDiff', 'q', 'DF']].to_numpy(), expected[:, :3], rtol=1e-9)
+        # studentized_range.sf integrates numerically; the p-value depends on how it's called.
+        np.testing.assert_allclose(rows['p-adj'], expected[:, 3], rtol=1e-4, atol=1e-8)
+
+
+def test_pairwise_comparisons_rejects_unknown_tests():
+    with pytest.raises(ValueError):
+        pairwise_comparisons(describe_wide(scores('integer'), VALUE_COLUMNS), test='bonferroni')
+
+
+@pytest.mark.parametrize('kind', ['integer', 'missing', 'fractional', 'complete'])
+def test_bootstrap_intervals_agree_with_the_normal_approximation(kind):
+    # 'complete' is fractional data without missing scores.
+    df = scores('fractional').dropna() if kind == 'complete' else scores(kind)
+    summary = describe_wide(df, VALUE_COLUMNS)
+    intervals = bootstrap_ci(df, VALUE_COLUMNS, n_boot=2000, workers=1)
+    assert intervals[['TeachingMethod', 'Subject']].equals(summary[['TeachingMethod', 'Subject']])
+    assert ((intervals['CILower'] < summary['Mean']) & (summary['Mean'] < intervals['CIUpper'])).all()
+    half_width = (intervals['CIUpper'] - intervals['CILower']) / 2
+    np.testing.assert_allclose(half_width, summary['CI'], rtol=0.15)
+
+
+@pytest.mark.parametrize('kind', ['integer', 'fractional'])
+def test_bootstrap_does_not_depend_on_the_worker_count(kind, monkeypatch):
+    monkeypatch.setattr(inference, 'PARALLEL_MIN_CELLS', 0)
+    monkeypatch.setattr(inference, 'BOOTSTRAP_BATCH_CELLS', 20_000)  # several batches
+    df = scores(kind)
+    progress = []
+    serial = bootstrap_ci(df, VALUE_COLUMNS, n_boot=300, seed=5, workers=1)
+    pooled = bootstrap_ci(df, VALUE_COLUMNS, n_boot=300, seed=5, workers=2,
+                          progress=lambda done, total: progress.append((done, total)))
+    pd.testing.assert_frame_equal(serial, pooled)
+    assert len(progress) > 1 and progress[-1] == (300, 300)
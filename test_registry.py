@@ -0,0 +1,78 @@
+"""Checks of the cross-session registry's building, leasing and eviction."""
+import gc
+import threading
+
+import numpy as np
+import pandas as pd
+
+from registry import Registry, nbytes
+
+
+def array(kib):
+    return np.zeros(kib * 128)  # kib KiB of float64
+
+
+def test_values_are_built_once_even_when_requested_concurrently():
+    registry = Registry()
+    builds = []
+    started = threading.Barrier(4)
+
+    def build():
+        builds.append(1)
+        return array(1)
+
+    def request(results):
+        started.wait()
+        results.append(registry.get('v1', 'table', build))
+
+    results = []
+    threads = [threading.Thread(target=request, args=(results,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+    assert all(value is results[0] for value in results)
+    assert registry.peek('v1', 'table') is results[0]
+    assert registry.peek('v1', 'missing', 'default') == 'default'
+
+
+def test_leased_versions_are_kept_and_released_ones_evicted_oldest_first():
+    registry = Registry(max_bytes=3 * 1024)
+    lease = registry.lease('v1')
+    registry.get('v1', 'a', lambda: array(1))
+    registry.get('v1', 'b', lambda: array(1))
+    registry.get('v2', 'a', lambda: array(1))
+    registry.get('v3', 'a', lambda: array(1))
+    # Over budget, so the unleased entries go, least recently used first.
+    assert registry.peek('v2', 'a') is None
+    assert registry.peek('v3', 'a') is not None
+    assert registry.peek('v1', 'a') is not None and registry.peek('v1', 'b') is not None
+
+    lease.release()
+    assert registry.stats() == {'entries': 3, 'bytes': 3 * 1024, 'leases': {}}
+    registry.peek('v3', 'a')
+    registry.peek('v1', 'a')  # leaves v1/b the least recently used
+    registry.get('v4', 'a', lambda: array(1))
+    assert registry.peek('v1', 'b') is None
+    assert all(registry.peek(*key) is not None for key in [('v1', 'a'), ('v3', 'a'), ('v4', 'a')])
+
+
+def test_a_lease_is_released_when_it_is_garbage_collected():
+    registry = Registry(max_bytes=0)
+    lease = registry.lease('v1')
+    registry.get('v1', 'a', lambda: array(1))
+    assert registry.stats()['leases'] == {'v1': 1}
+    del lease
+    gc.collect()
+    assert registry.stats() == {'entries': 0, 'bytes': 0, 'leases': {}}
+
+
+def test_nbytes_counts_strings_and_nested_values():
+    labels = np.array(['Facilitator', 'Group Learning'], dtype=object)
+    assert nbytes('Facilitator') == 11
+    assert nbytes(b'\x00' * 5) == 5
+    assert nbytes(labels) == labels.nbytes + 11 + 14
+    frame = pd.DataFrame({'Method': labels, 'Score': [1.0, 2.0]})
+    assert nbytes(frame) == frame.memory_usage(deep=True).sum()
+    assert nbytes({'figure': '{"data": []}', 'arrays': [array(1), (array(2),)]}) == 12 + 3 * 1024
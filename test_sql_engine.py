@@ -0,0 +1,48 @@
+"""Checks of the DuckDB query engine against the numpy statistics engine."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import METHODS, VALUE_COLUMNS, scores
+from stats_engine import describe_wide
+
+duckdb = pytest.importorskip('duckdb')
+
+from sql_engine import SQLEngine  # noqa: E402
+
+
+@pytest.fixture(params=['integer', 'missing', 'fractional', 'empty group'])
+def sheet(request):
+    if request.param != 'empty group':
+        return scores(request.param)
+    # A (method, subject) group whose scores are all missing keeps its row, with Count 0.
+    df = scores('missing')
+    df.loc[df['TeachingMethod'] == METHODS[0], 'MathScore'] = np.nan
+    return df
+
+
+def test_duckdb_engine_matches_stats_engine(sheet):
+    engine = SQLEngine(sheet, VALUE_COLUMNS)
+    try:
+        expected = describe_wide(sheet, VALUE_COLUMNS)
+        pd.testing.assert_frame_equal(engine.descriptive_stats(), expected, check_exact=False, rtol=1e-9)
+        top = expected.loc[expected.groupby('Subject')['Mean'].idxmax()].reset_index(drop=True)
+        pd.testing.assert_frame_equal(engine.top_methods(), top, check_exact=False, rtol=1e-9)
+        overall = sheet.melt(id_vars='TeachingMethod', value_vars=VALUE_COLUMNS, value_name='Score')
+        overall = overall.groupby('TeachingMethod', as_index=False)['Score'].mean()
+        pd.testing.assert_frame_equal(engine.overall_means(), overall, check_exact=False, rtol=1e-9)
+    finally:
+        engine.close()
+
+
+def test_duckdb_engine_reads_parquet(tmp_path):
+    df = scores('missing')
+    df['TeachingMethod'] = df['TeachingMethod'].astype('category')
+    path = tmp_path / 'scores.parquet'
+    df.to_parquet(path)
+    engine = SQLEngine(path, VALUE_COLUMNS, threads=1)
+    try:
+        pd.testing.assert_frame_equal(engine.descriptive_stats(), describe_wide(df, VALUE_COLUMNS),
+                                      check_exact=False, rtol=1e-9)
+    finally:
+        engine.close()
@@ -0,0 +1,280 @@
+"""Checks of the descriptive statistics kernels against pandas groupby."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import stats_engine
+from conftest import EXACT_COLUMNS, METHODS, VALUE_COLUMNS, assert_same_table, groupby_reference, melt_scores, scores
+from stats_engine import (MAX_HISTOGRAM_BINS, GroupState, IncrementalStats, QuantileSketch, StatsCube,
+                          binned_scores, describe_long,
+                          describe_wide, histogram_quantile, integer_range, merge_states, parallel_state, pool_map,
+                          score_histograms, sorted_box_stats)
+
+
+@pytest.mark.parametrize('kind', ['integer', 'missing', 'fractional'])
+def test_describe_long_matches_groupby(kind):
+    df = scores(kind)
+    assert_same_table(describe_long(melt_scores(df)), groupby_reference(df))
+
+
+def test_describe_long_keeps_groups_without_scores_and_drops_missing_keys():
+    df = scores('missing')
+    df.loc[df['TeachingMethod'] == METHODS[0], 'MathScore'] = np.nan
+    melted = melt_scores(df)
+    melted.loc[:9, 'TeachingMethod'] = None
+    reference = melted.groupby(['TeachingMethod', 'Subject'])['Score'].agg(['count', 'mean']).reset_index()
+    table = describe_long(melted)
+    pd.testing.assert_frame_equal(table[['TeachingMethod', 'Subject', 'Count', 'Mean']],
+                                  reference.set_axis(['TeachingMethod', 'Subject', 'Count', 'Mean'], axis=1),
+                                  check_dtype=False)
+    assert (table['Count'] == 0).sum() == 1
+
+
+@pytest.mark.parametrize('kind', ['integer', 'missing', 'fractional'])
+def test_describe_wide_matches_groupby(kind):
+    df = scores(kind)
+    assert_same_table(describe_wide(df, VALUE_COLUMNS, engine='sort'), groupby_reference(df))
+
+
+def test_describe_wide_matches_describe_long_on_other_labels():
+    df = scores('missing')
+    df['TeachingMethod'] = df['TeachingMethod'].astype('category')
+    long = describe_long(melt_scores(df).rename(columns={'TeachingMethod': 'Method', 'Subject': 'Course'}),
+                         keys=('Method', 'Course'))
+    wide = describe_wide(df.rename(columns={'TeachingMethod': 'Method'}), VALUE_COLUMNS,
+                         key='Method', column_name='Course', engine='sort')
+    pd.testing.assert_frame_equal(wide.reset_index(drop=True), long, check_dtype=False,
+                                  check_categorical=False)
+
+
+@pytest.mark.parametrize('kind', ['integer', 'missing'])
+@pytest.mark.parametrize('engine', ['auto', 'histogram'])
+def test_histogram_engine_matches_groupby(kind, engine):
+    df = scores(kind)
+    assert_same_table(describe_wide(df, VALUE_COLUMNS, engine=engine), groupby_reference(df))
+
+
+def test_histogram_engine_needs_integer_scores():
+    df = scores('fractional')
+    assert score_histograms(df, VALUE_COLUMNS) is None
+    with pytest.raises(ValueError):
+        describe_wide(df, VALUE_COLUMNS, engine='histogram')
+    assert_same_table(describe_wide(df, VALUE_COLUMNS, engine='auto'), groupby_reference(df))
+
+
+def test_integer_range():
+    assert integer_range([np.array([3, 7]), np.array([np.nan, 1.0, 5.0])]) == (1, 7)
+    assert integer_range([np.array([1.0, 2.5])]) is None
+    assert integer_range([np.array([0, MAX_HISTOGRAM_BINS])]) is None
+    assert integer_range([np.array([np.nan])]) is None
+
+
+@pytest.mark.parametrize('q', [0.1, 0.25, 0.5, 0.75, 0.9])
+def test_histogram_quantile_matches_numpy(q):
+    rng = np.random.default_rng(1)
+    values = [rng.integers(5, 15, size) for size in (1, 2, 7, 40)]
+    counts = np.stack([np.bincount(v - 5, minlength=10) for v in values] + [np.zeros(10, dtype=np.int64)])
+    expected = [np.quantile(v, q) for v in values] + [np.nan]
+    np.testing.assert_allclose(histogram_quantile(counts, 5, q), expected, rtol=1e-12)
+
+
+@pytest.mark.parametrize('kind', ['integer', 'missing', 'fractional'])
+def test_merged_shards_match_groupby(kind):
+    df = scores(kind)
+    shards = np.array_split(np.arange(len(df)), 4)
+    state = merge_states(GroupState.from_frame(df.iloc[rows], VALUE_COLUMNS) for rows in shards)
+    # Median, Mode and IQR survive merges only through histograms (integer scores).
+    columns = EXACT_COLUMNS if kind == 'fractional' else None
+    assert_same_table(state.describe(), groupby_reference(df), columns)
+
+
+def test_merge_handles_methods_missing_from_a_shard():
+    df = scores('integer')
+    first = df[df['TeachingMethod'] != METHODS[0]]
+    second = df.drop(first.index)
+    state = GroupState.from_frame(first, VALUE_COLUMNS).merge(GroupState.from_frame(second, VALUE_COLUMNS))
+    assert_same_table(state.describe(), groupby_reference(df))
+
+
+def test_merge_aligns_histograms_over_different_score_ranges():
+    df = scores('integer')
+    low = df[VALUE_COLUMNS].min(axis=1) < 75
+    state = GroupState.from_frame(df[low], VALUE_COLUMNS).merge(GroupState.from_frame(df[~low], VALUE_COLUMNS))
+    assert_same_table(state.describe(), groupby_reference(df))
+
+
+def test_merge_refuses_states_over_different_subjects():
+    df = scores('integer')
+    with pytest.raises(ValueError):
+        GroupState.from_frame(df, VALUE_COLUMNS).merge(GroupState.from_frame(df, VALUE_COLUMNS[:2]))
+
+
+def test_refresh_appends_new_students_and_rebuilds_after_corrections(monkeypatch):
+    df = scores('integer')
+    incremental = IncrementalStats(VALUE_COLUMNS)
+    incremental.refresh(df.iloc[:500], version=1)
+    rebuilds = []
+    rebuild = incremental.rebuild
+
+    def counted_rebuild(*args):
+        rebuilds.append(args)
+        return rebuild(*args)
+    monkeypatch.setattr(incremental, 'rebuild', counted_rebuild)
+
+    assert_same_table(incremental.refresh(df, version=2).describe(), groupby_reference(df))
+    assert not rebuilds
+    corrected = df.copy()
+    corrected.loc[3, 'MathScore'] = 0
+    assert_same_table(incremental.refresh(corrected, version=3).describe(), groupby_reference(corrected))
+    assert len(rebuilds) == 1
+    removed = corrected.drop(index=7)
+    assert_same_table(incremental.refresh(removed, version=4).describe(), groupby_reference(removed))
+    assert len(rebuilds) == 2
+
+
+def test_append_skips_rows_already_counted():
+    df = scores('missing')
+    incremental = IncrementalStats(VALUE_COLUMNS)
+    with pytest.raises(ValueError):
+        incremental.append(df)
+    incremental.rebuild(df.iloc[:400])
+    incremental.append(df.iloc[300:])
+    assert_same_table(incremental.state.describe(), groupby_reference(df))
+
+
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+
+def rank_error(values, estimate, q):
+    return abs(np.mean(values <= estimate) - q)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_quantile_sketch_stays_within_its_rank_error_in_bounded_memory(seed):
+    values = np.random.default_rng(seed).normal(size=200_000)
+    sketch = QuantileSketch.for_error(0.01, seed=seed)
+    for chunk in np.array_split(values, 20):
+        sketch.update(chunk)
+    assert sketch.n == len(values)
+    assert sum(len(level) for level in sketch.levels) < 3 * sketch.k
+    for q in QUANTILES:
+        assert rank_error(values, sketch.quantile(q), q) < 0.02
+
+
+def test_merged_quantile_sketches_summarise_the_union():
+    values = np.random.default_rng(0).exponential(size=100_000)
+    first = QuantileSketch.for_error(0.01, seed=1).update(values[:30_000])
+    second = QuantileSketch.for_error(0.01, seed=2).update(np.append(values[30_000:], np.nan))
+    merged = first.merge(second)
+    assert merged.n == len(values)
+    for q in QUANTILES:
+        assert rank_error(values, merged.quantile(q), q) < 0.02
+    assert np.isnan(QuantileSketch().quantile(0.5))
+
+
+def test_sketched_states_give_approximate_medians():
+    df = scores('fractional', n=6000)
+    shards = np.array_split(np.arange(len(df)), 3)
+    state = merge_states(GroupState.from_frame(df.iloc[rows], VALUE_COLUMNS, quantile_error=0.01)
+                         for rows in shards)
+    table = state.describe()
+    assert state.approximate
+    assert table.attrs['approximate'] == ['Median', 'IQR']
+    reference = groupby_reference(df)
+    assert_same_table(table, reference, EXACT_COLUMNS)
+    spread = reference['Range'].to_numpy()
+    assert np.all(np.abs(table['Median'] - reference['Median']).to_numpy() < 0.05 * spread)
+
+
+@pytest.mark.parametrize('kind', ['integer', 'missing'])
+def test_stats_cube_matches_groupby(kind):
+    df = scores(kind)
+    cube = StatsCube.from_frame(df, VALUE_COLUMNS)
+    assert_same_table(cube.to_frame(), groupby_reference(df))
+    overall = cube.rollup('Subject').to_frame()
+    melted = df.melt(id_vars='TeachingMethod', value_vars=VALUE_COLUMNS, value_name='Score')
+    reference = melted.groupby('TeachingMethod')['Score'].agg(['count', 'mean', 'median', 'std'])
+    np.testing.assert_allclose(overall[['Count', 'Mean', 'Median', 'StdDev']].to_numpy(dtype=np.float64),
+                               reference.to_numpy(), rtol=1e-9)
+
+
+def test_stats_cube_rolls_up_extra_dimensions():
+    df = scores('missing')
+    df['School'] = np.where(df['StudentID'] % 3 == 0, 'North', 'South')
+    df.loc[(df['School'] == 'North') & (df['TeachingMethod'] == METHODS[0]), 'School'] = 'South'
+    cube = StatsCube.from_frame(df, VALUE_COLUMNS, dims=('School',))
+    melted = melt_scores(df)
+    melted['School'] = np.tile(df['School'].to_numpy(), len(VALUE_COLUMNS))
+    by_school = melted.groupby(['TeachingMethod', 'School', 'Subject'])['Score'].agg(['count', 'mean', 'median'])
+    table = cube.to_frame()
+    # A (method, school) pair without students has no rows.
+    assert len(table) == len(by_school)
+    np.testing.assert_allclose(table[['Count', 'Mean', 'Median']].to_numpy(dtype=np.float64),
+                               by_school.to_numpy(), rtol=1e-9)
+    assert_same_table(cube.rollup('School').to_frame(), groupby_reference(df))
+
+
+@pytest.mark.parametrize('kind', ['integer', 'fractional'])
+def test_parallel_state_matches_groupby(kind):
+    df = scores(kind)
+    state = parallel_state(df, VALUE_COLUMNS, workers=2, min_rows=0)
+    columns = EXACT_COLUMNS if kind == 'fractional' else None
+    assert_same_table(state.describe(), groupby_reference(df), columns)
+
+
+def column_sum(arrays, column, parent):
+    return float(arrays[column].sum())
+
+
+def exit_in_worker(arrays, column, parent):
+    # Kills any pool worker it runs in; only the in-process fallback completes it.
+    if os.getpid() != parent:
+        os._exit(1)
+    return column_sum(arrays, column, parent)
+
+
+def test_pool_map_finishes_in_process_when_a_worker_dies():
+    arrays = [np.arange(10.0), np.ones(5)]
+    tasks = [(0, os.getpid()), (1, os.getpid())]
+    assert pool_map(exit_in_worker, arrays, tasks, workers=2) == [45.0, 5.0]
+    assert 2 not in stats_engine._pools
+    # The next call starts a fresh pool instead of reusing the broken one.
+    assert pool_map(column_sum, arrays, tasks, workers=2) == [45.0, 5.0]
+
+
+def box_reference(values):
+    # What plotly computes from the raw scores of one box.
+    q1, median, q3 = values.quantile([0.25, 0.5, 0.75])
+    inside = values[(values >= q1 - 1.5 * (q3 - q1)) & (values <= q3 + 1.5 * (q3 - q1))]
+    return {'q1': q1, 'median': median, 'q3': q3, 'lowerfence': inside.min(),
+            'upperfence': inside.max(), 'mean': values.mean()}
+
+
+def test_binned_scores_match_numpy_histograms_and_raw_box_statistics():
+    df = scores('fractional')
+    distributions = binned_scores(df, VALUE_COLUMNS, bins=12)
+    box = distributions.box_stats()
+    for j, column in enumerate(VALUE_COLUMNS):
+        edges = np.histogram_bin_edges(df[column].dropna(), bins=12)
+        centres, width = distributions.bins(j)
+        np.testing.assert_allclose(centres, (edges[:-1] + edges[1:]) / 2)
+        assert width == pytest.approx(edges[1] - edges[0])
+        for m, method in enumerate(distributions.methods):
+            values = df.loc[df['TeachingMethod'] == method, column].dropna()
+            np.testing.assert_array_equal(distributions.counts[m, j], np.histogram(values, bins=edges)[0])
+            for name, expected in box_reference(values).items():
+                assert box[name][m, j] == pytest.approx(expected, rel=1e-12), name
+
+
+def test_sorted_box_stats_match_the_histogram_box_statistics():
+    df = scores('missing')
+    histograms = score_histograms(df, VALUE_COLUMNS)
+    codes, methods = pd.factorize(df['TeachingMethod'], sort=True)
+    for j, column in enumerate(VALUE_COLUMNS):
+        # Group 4 has no students.
+        box = sorted_box_stats(codes, df[column].to_numpy(), len(methods) + 1)
+        for name, expected in histograms.box_stats().items():
+            np.testing.assert_allclose(box[name][:-1], expected[:, j], rtol=1e-12)
+            assert np.isnan(box[name][-1])